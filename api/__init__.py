@@ -1,10 +1,25 @@
+import collections
+import datetime
+import hashlib
+import logging
 import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+
 import requests
+from flask import Response, request
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_options_header
+
+from api.cache import LRUCache, SQLiteCache, single_flight
+from api.vega import vega_spec
+from api.encoding import compact_data
+from api import fastjson
+from api.snapshot import data_version
 
-from api.utils import generate_time_series_exponential_growth_data, generate_multi_time_series_exponential_growth_data, \
-    generate_scatter_plot_data, generate_multi_scatter_plot_data, generate_histogram_data, get_multi_time_series_data, \
-    get_multi_time_series_nytimes_data
 
+logger = logging.getLogger(__name__)
 
 pds_host = os.getenv("PDS_HOST", "localhost")
 pds_port = os.getenv("PDS_PORT", "8080")
@@ -206,7 +221,72 @@ guidance = {
 }
 
 
+patient_variable_defaults = {var["id"]: var for var in config["settingsDefaults"]["patientVariables"]}
+cohort_mode = os.getenv("COHORT_MODE", "0") == "1"
+cohort_max_bytes = int(os.getenv("COHORT_MAX_BYTES", "0"))
+ndjson_mimetype = "application/x-ndjson"
+compact_precision = int(os.getenv("COMPACT_PRECISION", "6"))
+guidance_cacheable = os.getenv("GUIDANCE_CACHEABLE", "0") == "1"
+
+result_cache_file = os.getenv("RESULT_CACHE_FILE", "")
+result_cache = SQLiteCache(result_cache_file, int(os.getenv("RESULT_CACHE_SIZE", "1024"))) \
+    if result_cache_file else None
+
+guidance_executor_type = os.getenv("GUIDANCE_EXECUTOR", "none")
+guidance_workers = int(os.getenv("GUIDANCE_WORKERS", str(os.cpu_count() or 1)))
+guidance_queue = int(os.getenv("GUIDANCE_QUEUE", str(2 * guidance_workers)))
+if guidance_executor_type == 'thread':
+    guidance_executor = ThreadPoolExecutor(max_workers=guidance_workers, thread_name_prefix="guidance")
+elif guidance_executor_type == 'process':
+    guidance_executor = ProcessPoolExecutor(max_workers=guidance_workers)
+else:
+    guidance_executor = None
+
+vis_spec_cache = LRUCache(maxsize=int(os.getenv("VIS_SPEC_CACHE_SIZE", "256")),
+                          ttl=float(os.getenv("VIS_SPEC_CACHE_TTL", "86400")))
+location_cache = LRUCache(maxsize=int(os.getenv("LOCATION_CACHE_SIZE", "256")))
+vis_spec_mode = os.getenv("VIS_SPEC_MODE", "remote")
+vis_spec_timeout = float(os.getenv("VIS_SPEC_TIMEOUT", "10"))
+vis_spec_workers = int(os.getenv("VIS_SPEC_WORKERS", "8"))
+
+
+def _start_vis_pool():
+    """
+    create the pooled tx-vis session and the executor its requests run on. A forked child, e.g. a
+    GUIDANCE_EXECUTOR=process pool process or a gunicorn worker forked from a preloaded master, gets new ones:
+    the threads of the parent's executor do not exist in the child, so futures submitted to it would never run
+    """
+    global vis_session, vis_executor
+    vis_session = requests.Session()
+    vis_session.mount("http://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=vis_spec_workers))
+    vis_executor = ThreadPoolExecutor(max_workers=vis_spec_workers, thread_name_prefix="vis-spec")
+
+
+_start_vis_pool()
+os.register_at_fork(after_in_child=_start_vis_pool)
+
+
+def _vis_spec_key(args):
+    """
+    :param args: generate_vis_spec argument tuple, with or without the time unit
+    :return: the vis spec cache key of args, with the time unit
+    """
+    return tuple(args) + ('',) * (6 - len(args))
+
+
 def generate_vis_spec(typeid, x_axis_title, y_axis_title, chart_title, chart_desc, time_unit=''):
+    if vis_spec_mode == 'local':
+        return vega_spec(typeid, x_axis_title, y_axis_title, chart_title, chart_desc, time_unit)
+    key = (typeid, x_axis_title, y_axis_title, chart_title, chart_desc, time_unit)
+    spec = vis_spec_cache.get(key)
+    if spec is not None:
+        return spec
+    return _request_vis_spec(*key)
+
+
+@single_flight
+def _request_vis_spec(typeid, x_axis_title, y_axis_title, chart_title, chart_desc, time_unit):
+    key = (typeid, x_axis_title, y_axis_title, chart_title, chart_desc, time_unit)
     json_post_headers = {
         "Content-Type": "application/json",
         "Accept": "application/json"
@@ -220,191 +300,669 @@ def generate_vis_spec(typeid, x_axis_title, y_axis_title, chart_title, chart_des
         "time_unit": time_unit
     }
     url_str = "http://{}:{}/{}/plugin/tx-vis/vega_spec".format(pds_host, pds_port, pds_version)
-    resp = requests.post(url_str, headers=json_post_headers, json=vega_spec_input)
+    try:
+        resp = vis_session.post(url_str, headers=json_post_headers, json=vega_spec_input, timeout=vis_spec_timeout)
+    except requests.RequestException as e:
+        logger.warning("tx-vis request for %s failed: %s", typeid, e)
+        return {}
     # resp = requests.post("http://tx-vis:8080/vega_spec", headers=json_post_headers, json=vega_spec_input)
     if resp.status_code == 200:
-        return resp.json()
+        spec = resp.json()
+        vis_spec_cache.put(key, spec)
+        return spec
     else:
         return {}
 
 
-def generate_vis_outputs(age=None, weight=None, bmi=None, location=None):
+def submit_vis_specs(spec_args):
+    """
+    start generating several vis specs concurrently on the vis executor
+    :param spec_args: list of generate_vis_spec argument tuples
+    :return: (pending, deadline) to pass to collect_vis_specs; pending holds a cached spec or a future per tuple
+    """
+    pending = []
+    for args in spec_args:
+        spec = vega_spec(*args) if vis_spec_mode == 'local' else vis_spec_cache.get(_vis_spec_key(args))
+        pending.append(spec if spec is not None else vis_executor.submit(generate_vis_spec, *args))
+    return pending, time.monotonic() + vis_spec_timeout
+
+
+def collect_vis_specs(spec_args, pending, deadline):
+    """
+    wait for the specs started by submit_vis_specs
+    :return: list of specs in the order of spec_args; a spec that is not ready by the deadline is {}
+    """
+    specs = []
+    for args, item in zip(spec_args, pending):
+        if isinstance(item, Future):
+            try:
+                item = item.result(timeout=max(deadline - time.monotonic(), 0))
+            except FuturesTimeoutError:
+                logger.warning("tx-vis request for %s timed out", args[0])
+                item = {}
+        specs.append(item)
+    return specs
+
+
+def generate_vis_specs(spec_args):
+    """
+    generate several vis specs concurrently
+    :param spec_args: list of generate_vis_spec argument tuples
+    :return: list of specs in the same order; a spec that is not ready within VIS_SPEC_TIMEOUT seconds is {}
+    """
+    return collect_vis_specs(spec_args, *submit_vis_specs(spec_args))
+
+
+def vis_output_table(bmi=None, location=None, series=None):
+    """
+    describe the advanced outputs for the configured selector
+    :param bmi: patient BMI, the BMI output is only included when it is set
+    :param location: hospital location (state abbreviation)
+    :param series: window and resolution of the dated time series as a tuple of (name, value) pairs, see
+    api.timeseries.resample; the full daily series by default
+    :return: list of dicts with the output id, name and description, a 'data' callable producing the output data
+    and the 'spec' arguments of generate_vis_spec. Outputs that depend on patient variables and not only on the
+    location are marked 'patient', outputs whose data depends on series are marked 'series'
+    """
+    # api.utils pulls in numpy and the data layer, which /config and cached responses never need
+    from api.utils import generate_scatter_plot_data, generate_multi_scatter_plot_data, generate_histogram_data, \
+        get_multi_time_series_data, get_multi_time_series_nytimes_data
     p_loc = location if location else "the patient's location"
-    outputs = [
+    state = location if location else 'NC'
+    table = [
         {
             "id": "oid-1",
             "name": "Active cases and deaths",
             "description": "Daily active cases and deaths at {}".format(p_loc),
-            "data": get_multi_time_series_nytimes_data(state=location if location else 'NC'),
-            "specs": [
-                generate_vis_spec("multiple_line_chart", "Date", "Number of people",
-                                  "Active cases and deaths",
-                                  "Number of currently infected cases and deaths at {}.".format(p_loc),
-                                  "monthdate")
-            ]
+            "series": True,
+            "data": lambda: get_multi_time_series_nytimes_data(state=state, **dict(series or ())),
+            "spec": ("multiple_line_chart", "Date", "Number of people",
+                     "Active cases and deaths",
+                     "Number of currently infected cases and deaths at {}.".format(p_loc),
+                     "monthdate")
         }
     ]
     if selector_val == 'treatment':
-        outputs.append({
+        table.append({
             "id": "oid-2",
             "name": "Epidemics trend prediction",
             "description": "SIR (Susceptible-Infected-Removed) predictions for the next "
                            "60 days at {}".format(p_loc),
-            "data": get_multi_time_series_data(state=location if location else 'NC'),
+            "data": lambda: get_multi_time_series_data(state=state),
             #"data": generate_multi_time_series_exponential_growth_data(50, 2, ['all age group', 'patient age group']),
-            "specs": [
-                generate_vis_spec("multiple_line_chart", "Date (Days since March 24)", "Number of people",
-                                  "Infected, recovered, susceptible, dead predictions",
-                                  "Use Penn Death model to make SIR (Susceptible-Infected-Removed) predictions for "
-                                  "the next 60 days at {} given the number of susceptible, infected, recovered, and "
-                                  "death today".format(p_loc))
-            ]
+            "spec": ("multiple_line_chart", "Date (Days since March 24)", "Number of people",
+                     "Infected, recovered, susceptible, dead predictions",
+                     "Use Penn Death model to make SIR (Susceptible-Infected-Removed) predictions for "
+                     "the next 60 days at {} given the number of susceptible, infected, recovered, and "
+                     "death today".format(p_loc))
         })
-        outputs.append({
+        table.append({
             "id": "oid-3",
             "name": "Mortality",
             "description": "Patient mortality projection for the patient age group at {}".format(p_loc),
-            "data": generate_scatter_plot_data(100),
-            "specs": [
-                generate_vis_spec("scatter_plot", "Number of confirmed cases", "Number of deaths",
-                                  "Projected patient mortality",
-                                  "patient mortality projected by model for the patient age group at {}".format(p_loc))
-            ]
+            "data": lambda: generate_scatter_plot_data(100),
+            "spec": ("scatter_plot", "Number of confirmed cases", "Number of deaths",
+                     "Projected patient mortality",
+                     "patient mortality projected by model for the patient age group at {}".format(p_loc))
         })
-        outputs.append({
+        table.append({
             "id": "oid-4",
             "name": "Risk factor by age",
             "description": "Risk factor by age groups at {}".format(p_loc),
-            "data": generate_histogram_data(100),
-            "specs": [
-                generate_vis_spec("histogram", "Age", "Risk factor", "Risk factor by age",
-                                  "Risk factor by age prejected by model at {}".format(p_loc))
-            ]
+            "data": lambda: generate_histogram_data(100),
+            "spec": ("histogram", "Age", "Risk factor", "Risk factor by age",
+                     "Risk factor by age prejected by model at {}".format(p_loc))
         })
         if bmi:
-            outputs.append({
+            table.append({
                 "id": "oid-5",
+                "patient": True,
                 "name": "Risk factor by BMI",
                 "description": "Risk factor by BMI at {}".format(p_loc),
-                "data": generate_histogram_data(100),
-                "specs": [
-                    generate_vis_spec("histogram", "BMI", "Risk factor", "Risk factor by BMI",
-                                      "Risk factor by BMI prejected by model at {}".format(p_loc))
-                ]
+                "data": lambda: generate_histogram_data(100),
+                "spec": ("histogram", "BMI", "Risk factor", "Risk factor by BMI",
+                         "Risk factor by BMI prejected by model at {}".format(p_loc))
             })
     else:
         # resource management
-        outputs.append({
+        table.append({
             "id": "oid-2",
             "name": "Hospital resource usage",
             "description": "Projected hospital resource usage at {}".format(p_loc),
-            "data": get_multi_time_series_data(state=location if location else 'NC', type='Hospital Use'),
+            "data": lambda: get_multi_time_series_data(state=state, type='Hospital Use'),
             #"data": generate_multi_time_series_exponential_growth_data(50, 3, ['ICU beds', 'Ventilators', 'All resources']),
-            "specs": [
-                generate_vis_spec("multiple_line_chart", "Date (Days since March 24)", "Number of people",
-                                  "Hospital resources usage",
-                                  "Projected hospital resource usage at {}".format(p_loc)),
-            ]
+            "spec": ("multiple_line_chart", "Date (Days since March 24)", "Number of people",
+                     "Hospital resources usage",
+                     "Projected hospital resource usage at {}".format(p_loc))
         })
-        outputs.append(
-            {
-                "id": "oid-6",
-                "name": "Clinician to patient plot",
-                "description": "Patient to clinician plot at three nearby hospitals",
-                "data": generate_multi_scatter_plot_data(50, 4, ['UNC hospital', 'Duke hospital', "WakeMed",
-                                                                 "Mobile hospitals"]),
-                "specs": [
-                    generate_vis_spec("multiple_scatter_plot", "Number of patients", "Number of clinicians",
-                                      "Clinician to patient scatter plot",
-                                      "Clinician to patient scatter plot at three nearby hospitals"),
-                ]
-            })
-        outputs.append(
-            {
-                "id": "oid-7",
-                "name": "PPE to clinician plot",
-                "description": "PPE to clinician plot at three nearby hospitals",
-                "data": generate_multi_scatter_plot_data(50, 4, ['UNC hospital', 'Duke hospital', "WakeMed",
-                                                                 "Mobile hospitals"]),
-                "specs": [
-                    generate_vis_spec("multiple_scatter_plot", "Number of clinicians", "Number of PPEs",
-                                      "PPE to clinician scatter plot",
-                                      "PPE to clinician scatter plot at three nearby hospitals"),
-                ]
-            }
-        )
-        outputs.append(
-            {
-                "id": "oid-8",
-                "name": "ICU bed to patient plot",
-                "description": "ICU bed to patient plot at three nearby hospitals",
-                "data": generate_multi_scatter_plot_data(50, 3, ['UNC hospital', 'Duke hospital', "WakeMed",
-                                                                 "Mobile hospitals"]),
-                "specs": [
-                    generate_vis_spec("multiple_scatter_plot", "Number of patients", "Number of ICU beds",
-                                      "ICU bed to patient scatter plot",
-                                      "ICU bed to patient scatter plot at three nearby hospitals"),
-                ]
-            }
-        )
-        outputs.append(
-            {
-                "id": "oid-9",
-                "name": "Ventilator to patient plot",
-                "description": "Ventilator to patient plot at three nearby hospitals",
-                "data": generate_multi_scatter_plot_data(50, 3, ['UNC hospital', 'Duke hospital', "WakeMed",
-                                                                 "Mobile hospitals"]),
-                "specs": [
-                    generate_vis_spec("multiple_scatter_plot", "Number of patients", "Number of ventilators",
-                                      "Ventilator to patient scatter plot",
-                                      "Ventilator to patient scatter plot at three nearby hospitals"),
-                ]
-            }
-        )
+        table.append({
+            "id": "oid-6",
+            "name": "Clinician to patient plot",
+            "description": "Patient to clinician plot at three nearby hospitals",
+            "data": lambda: generate_multi_scatter_plot_data(50, 4, ['UNC hospital', 'Duke hospital', "WakeMed",
+                                                                     "Mobile hospitals"]),
+            "spec": ("multiple_scatter_plot", "Number of patients", "Number of clinicians",
+                     "Clinician to patient scatter plot",
+                     "Clinician to patient scatter plot at three nearby hospitals")
+        })
+        table.append({
+            "id": "oid-7",
+            "name": "PPE to clinician plot",
+            "description": "PPE to clinician plot at three nearby hospitals",
+            "data": lambda: generate_multi_scatter_plot_data(50, 4, ['UNC hospital', 'Duke hospital', "WakeMed",
+                                                                     "Mobile hospitals"]),
+            "spec": ("multiple_scatter_plot", "Number of clinicians", "Number of PPEs",
+                     "PPE to clinician scatter plot",
+                     "PPE to clinician scatter plot at three nearby hospitals")
+        })
+        table.append({
+            "id": "oid-8",
+            "name": "ICU bed to patient plot",
+            "description": "ICU bed to patient plot at three nearby hospitals",
+            "data": lambda: generate_multi_scatter_plot_data(50, 3, ['UNC hospital', 'Duke hospital', "WakeMed",
+                                                                     "Mobile hospitals"]),
+            "spec": ("multiple_scatter_plot", "Number of patients", "Number of ICU beds",
+                     "ICU bed to patient scatter plot",
+                     "ICU bed to patient scatter plot at three nearby hospitals")
+        })
+        table.append({
+            "id": "oid-9",
+            "name": "Ventilator to patient plot",
+            "description": "Ventilator to patient plot at three nearby hospitals",
+            "data": lambda: generate_multi_scatter_plot_data(50, 3, ['UNC hospital', 'Duke hospital', "WakeMed",
+                                                                     "Mobile hospitals"]),
+            "spec": ("multiple_scatter_plot", "Number of patients", "Number of ventilators",
+                     "Ventilator to patient scatter plot",
+                     "Ventilator to patient scatter plot at three nearby hospitals")
+        })
+    return table
+
+
+def _build_outputs(table, data_format=None):
+    spec_args = [out["spec"] for out in table]
+    pending, deadline = submit_vis_specs(spec_args)
+    outputs = [
+        {
+            "id": out["id"],
+            "name": out["name"],
+            "description": out["description"],
+            "data": compact_data(out["data"](), compact_precision) if data_format == 'compact' else out["data"]()
+        }
+        for out in table
+    ]
+    for output, spec in zip(outputs, collect_vis_specs(spec_args, pending, deadline)):
+        output["specs"] = [spec]
     return outputs
 
 
+def generate_vis_outputs(age=None, weight=None, bmi=None, location=None, memo=None, data_format=None,
+                         output_ids=None, series=None):
+    """
+    :param memo: optional dict shared by the patients of one request; outputs that only depend on the location
+    are computed once per location and reused from it. The reused output dicts are shared, not copied. Outputs
+    that only depend on the location are also kept in a per-worker cache until the data version changes
+    :param data_format: 'compact' to encode each output's data as columns (see api.encoding), points by default
+    :param output_ids: collection of the output ids to compute, all outputs of the selector by default
+    :param series: window and resolution of the dated time series, see vis_output_table
+    :return: list of outputs; with RESULT_CACHE_FILE set the whole list is cached across workers, keyed on the
+    selector, location, whether the BMI is set, the data format, the output ids, the series options and the
+    data version
+    """
+    if result_cache is None:
+        return _generate_vis_outputs(bmi, location, memo, data_format, output_ids, series)
+    version = data_version()
+    key = repr((selector_val, location, bool(bmi), data_format,
+                sorted(output_ids) if output_ids is not None else None, series, version))
+    outputs = memo.get(key) if memo is not None else None
+    if outputs is None:
+        outputs = result_cache.get(key)
+    if outputs is None:
+        outputs = _generate_vis_outputs(bmi, location, memo, data_format, output_ids, series)
+        # a failed tx-vis request leaves an empty spec, and a snapshot reloaded meanwhile may have served data of
+        # another version, neither should be cached
+        if all(output["specs"][0] for output in outputs) and data_version() == version:
+            result_cache.put(key, outputs)
+    if memo is not None:
+        memo[key] = outputs
+    return outputs
+
+
+def _generate_vis_outputs(bmi=None, location=None, memo=None, data_format=None, output_ids=None, series=None):
+    # the table only describes the outputs, their data and specs are produced for the requested ones alone
+    table = [out for out in vis_output_table(bmi=bmi, location=location, series=series)
+             if output_ids is None or out["id"] in output_ids]
+    if memo is None:
+        memo = {}
+    version = data_version()
+
+    def key(out):
+        if out.get("patient"):
+            return None
+        return location, data_format, series if out.get("series") else None, out["id"]
+
+    for out in table:
+        if key(out) is not None and key(out) not in memo:
+            cached = location_cache.get(key(out) + (version,))
+            if cached is not None:
+                memo[key(out)] = cached
+    missing = [out for out in table if key(out) is None or key(out) not in memo]
+    built = dict(zip((out["id"] for out in missing), _build_outputs(missing, data_format)))
+    # a snapshot reloaded while the outputs were built may have served data of another version
+    current = not missing or data_version() == version
+    for out in missing:
+        if key(out) is not None:
+            memo[key(out)] = built[out["id"]]
+            # a failed tx-vis request leaves an empty spec, which should not be cached
+            if built[out["id"]]["specs"][0] and current:
+                location_cache.put(key(out) + (version,), built[out["id"]])
+    return [built[out["id"]] if out["id"] in built else memo[key(out)] for out in table]
+
+
+def warmup_locations():
+    """
+    :return: the default location (None) and every location in the pdspi-guidance-sars:loc enum
+    """
+    locations = [None]
+    for param in config["settingsDefaults"]["modelParameters"]:
+        if param["id"] == "pdspi-guidance-sars:loc":
+            locations += param["legalValues"]["enum"]
+    return locations
+
+
+def prewarm_vis_specs():
+    """
+    fill the vis spec cache for every location in the pdspi-guidance-sars:loc enum and for the default location;
+    nothing to do when VIS_SPEC_MODE is local
+    :return: number of specs cached
+    """
+    if vis_spec_mode == 'local':
+        return 0
+    spec_args = [out["spec"] for location in warmup_locations()
+                 for out in vis_output_table(bmi=True, location=location)]
+    list(vis_executor.map(lambda args: generate_vis_spec(*args), spec_args))
+    return len(vis_spec_cache)
+
+
+warmup_mode = os.getenv("WARMUP", "none")
+warmup_state = {"ready": warmup_mode != "boot", "timings": {}, "failed": []}
+_warmup_pid = None
+_warmup_lock = threading.Lock()
+
+
+def warmup():
+    """
+    compute and cache the outputs of every location in the pdspi-guidance-sars:loc enum and of the default
+    location: data, model curves and vis specs. The worker is ready once it is done, unless every location failed
+    :return: dict with 'ready', the warmup time in seconds of each location and the locations that 'failed'
+    """
+    timings = {}
+    failed = []
+    for location in warmup_locations():
+        start = time.monotonic()
+        try:
+            generate_vis_outputs(bmi=True, location=location)
+        except Exception as e:
+            logger.warning("warmup of %s failed: %s", location, e)
+            failed.append(location or "default")
+        timings[location or "default"] = round(time.monotonic() - start, 3)
+        logger.info("warmed up %s in %.3f s", location or "default", timings[location or "default"])
+    warmup_state.update(ready=len(failed) < len(timings), timings=timings, failed=failed)
+    return warmup_state
+
+
+def start_warmup():
+    """
+    run warmup in a background thread, so the worker serves requests while /ready reports 503 until it is done.
+    The warmup only starts once per process: later calls, e.g. before each request, do nothing
+    """
+    global _warmup_pid
+    with _warmup_lock:
+        if _warmup_pid == os.getpid():
+            return
+        _warmup_pid = os.getpid()
+    threading.Thread(target=warmup, name="warmup", daemon=True).start()
+
+
+def get_ready():
+    state = dict(warmup_state)
+    if result_cache is not None:
+        # counted by all the workers sharing RESULT_CACHE_FILE
+        state["resultCache"] = result_cache.stats()
+    return state, 200 if state["ready"] else 503
+
+
+def post_warmup():
+    return warmup()
+
+
+config_json = fastjson.dumps(config)
+config_etag = hashlib.sha1(config_json).hexdigest()
+# serialized guidance without its closing brace, the per-patient keys are appended to it
+guidance_json_head = fastjson.dumps(guidance)[:-1]
+
+
 def get_config():
-    return config
+    response = Response(config_json, mimetype="application/json")
+    response.set_etag(config_etag)
+    return response.make_conditional(request)
+
+
+def _guidance_error(event, action, code=400):
+    return {
+        "message": [{
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "event": event,
+            "source": piid,
+            "level": 3,
+            "action": action
+        }]
+    }, code
 
 
-def get_guidance(body):
+def _encode_guidance(patient_guidance, encoded=None) -> bytes:
+    """
+    serialize the guidance of one patient, splicing in the pre-serialized static part of the guidance
+    :param encoded: optional dict shared by the patients of one request; each shared advanced output is only
+    serialized once
+    """
+    if patient_guidance.keys() != guidance.keys() | {"settingsUsed", "advanced"}:
+        return fastjson.dumps(patient_guidance)
+    outputs = []
+    for output in patient_guidance["advanced"]:
+        if encoded is None:
+            outputs.append(fastjson.dumps(output))
+            continue
+        if id(output) not in encoded:
+            # keep output alive so that its id is not reused within the request
+            encoded[id(output)] = (output, fastjson.dumps(output))
+        outputs.append(encoded[id(output)][1])
+    return b"".join([
+        guidance_json_head,
+        b',"settingsUsed":', fastjson.dumps(patient_guidance["settingsUsed"]),
+        b',"advanced":[', b",".join(outputs), b"]}"
+    ])
+
+
+def _output_ids(value):
+    """
+    :param value: output ids as a list or a comma separated string
+    :return: frozenset of the output ids, None (all outputs) if value is empty
+    :raise ValueError: for an id that is not an output of the selector
+    """
+    if isinstance(value, str):
+        value = value.split(",")
+    ids = frozenset(oid.strip() for oid in value or [] if oid.strip())
+    known = [out["id"] for out in vis_output_table(bmi=True)]
+    unknown = ids - set(known)
+    if unknown:
+        raise ValueError("unknown outputs {}, expected some of {}".format(", ".join(sorted(unknown)),
+                                                                         ", ".join(known)))
+    return ids or None
+
+
+def _series_options(value):
+    """
+    :param value: dict with any of start and end (ISO dates), last (number of days, at least 1), resolution
+    ('daily', 'weekly' or 'lttb') and points (number of points per group for 'lttb', at least 3)
+    :return: the options as a sorted tuple of (name, value) pairs, None for the full daily series
+    :raise ValueError: for an unknown option or an invalid value
+    :raise TypeError: if value is not a dict
+    """
+    from api.timeseries import resolutions
+    if value is not None and not isinstance(value, dict):
+        raise TypeError("series options must be an object, not {}".format(type(value).__name__))
+    options = {k: v for k, v in (value or {}).items() if v is not None}
+    unknown = set(options) - {"start", "end", "last", "resolution", "points"}
+    if unknown:
+        raise ValueError("unknown series options {}".format(", ".join(sorted(unknown))))
+    if options.get("resolution", "daily") not in resolutions:
+        raise ValueError("unknown resolution {}, expected one of {}".format(options["resolution"],
+                                                                           ", ".join(resolutions)))
+    for k in ("start", "end"):
+        if k in options:
+            options[k] = datetime.date.fromisoformat(str(options[k])).isoformat()
+    for k, minimum in (("last", 1), ("points", 3)):
+        if k in options:
+            options[k] = int(options[k])
+            if options[k] < minimum:
+                raise ValueError("{} must be at least {}".format(k, minimum))
+    return tuple(sorted(options.items())) or None
+
+
+# model parameters read from each body item, mapped to the generate_vis_outputs argument they set
+model_parameters = {
+    'pdspi-guidance-sars:loc': ('location', lambda value: value),
+    'pdspi-guidance-sars:format': ('data_format', lambda value: value),
+    'pdspi-guidance-sars:outputs': ('output_ids', _output_ids),
+    'pdspi-guidance-sars:series': ('series', _series_options)
+}
+
+
+def _model_parameter_error(body):
+    """
+    :return: the error response for the first model parameter of body with an invalid value, None if they are
+    all valid
+    """
+    for body_item in body:
+        for var in body_item.get("settingsRequested", {}).get("modelParameters", []):
+            if var["id"] in model_parameters:
+                try:
+                    model_parameters[var["id"]][1](var["parameterValue"]["value"])
+                except (ValueError, TypeError) as e:
+                    return _guidance_error("Invalid value of {}: {}".format(var["id"], e), "Returned no guidance")
+    return None
+
+
+def _patient_settings(body_item, params, inputs):
+    """
+    read the model parameters and patient variables of one body item
+    :param params: generate_vis_outputs arguments set by the previous body items, kept if this one does not set them
+    :param inputs: patient variables reported by the previous body items, not modified
+    :return: (params, age, weight, bmi, inputs), inputs is None if the item has no patient variables and otherwise
+    a new list of the previous variables followed by this item's, or only this item's in cohort mode
+    """
     def extract(var, attr):
-        return var.get(attr, next(filter(lambda rpv: rpv["id"] == var["id"],
-                                         config["settingsDefaults"]["patientVariables"]))[attr])
+        return var[attr] if attr in var else patient_variable_defaults[var["id"]][attr]
+
+    if 'settingsRequested' in body_item and 'modelParameters' in body_item['settingsRequested']:
+        params = dict(params)
+        for var in body_item["settingsRequested"]["modelParameters"]:
+            if var['id'] in model_parameters:
+                name, parse = model_parameters[var['id']]
+                params[name] = parse(var['parameterValue']['value'])
+    age = None
+    weight = None
+    bmi = None
+    if 'settingsRequested' not in body_item or 'patientVariables' not in body_item['settingsRequested']:
+        return params, age, weight, bmi, None
+    entries = []
+    for var in body_item['settingsRequested']["patientVariables"]:
+        if var['id'] == 'LOINC:30525-0':
+            age = var["variableValue"]['value']
+        elif var['id'] == 'LOINC:29463-7':
+            weight = var["variableValue"]['value']
+        elif var['id'] == 'LOINC:39156-5':
+            bmi = var["variableValue"]['value']
+        entries.append({
+            "id": var["id"],
+            "title": extract(var, "title"),
+            "how": var["how"],
+            "why": extract(var, "why"),
+            "variableValue": var["variableValue"],
+            "legalValues": extract(var, "legalValues"),
+            "timestamp": var.get("timestamp", "2020-02-18T18:54:57.099Z")
+        })
+    # each patient only reports its own variables in cohort mode; an item that fails partway reports none of them
+    return params, age, weight, bmi, entries if cohort_mode else inputs + entries
 
+
+def _patient_guidance(inputs, age=None, weight=None, bmi=None, params=None, memo=None):
+    return {
+        **guidance,
+        "settingsUsed": {'patientVariables': inputs},
+        "advanced": generate_vis_outputs(age=age, weight=weight, bmi=bmi, memo=memo, **(params or {}))
+    }
+
+
+def _patient_error(inputs, e):
+    logger.exception("guidance failed for a patient", exc_info=e)
+    message, _ = _guidance_error("Guidance failed for this patient: {}".format(repr(e)),
+                                 "Returned no guidance for this patient and continued with the others")
+    return {
+        **guidance,
+        "cards": [],
+        "settingsUsed": {'patientVariables': inputs if inputs is not None else []},
+        "advanced": [],
+        **message
+    }
+
+
+def _iter_guidance(body, params=None):
+    """
+    yield the guidance of each patient in body, in body order, as soon as it is ready. With GUIDANCE_EXECUTOR
+    set, patients are computed in parallel with at most GUIDANCE_QUEUE of them in flight, and a patient that
+    fails gets an entry with an error message instead of failing the whole request
+
+    :param params: generate_vis_outputs arguments (data_format, output_ids, series) used until a body item sets
+    the corresponding model parameter
+    """
     inputs = []
-    location = None
-    ret_guidance = []
+    params = {"location": None, **(params or {})}
+    memo = {}
 
+    if guidance_executor is None:
+        for body_item in body:
+            params, age, weight, bmi, patient_inputs = _patient_settings(body_item, params, inputs)
+            if patient_inputs is not None:
+                inputs = patient_inputs
+                yield _patient_guidance(inputs, age, weight, bmi, params, memo)
+        return
+
+    # the request-scoped memo cannot be shared with other processes
+    shared_memo = memo if guidance_executor_type == 'thread' else None
+    queue = max(guidance_queue, 1)
+    in_flight = collections.deque()
     for body_item in body:
-        if 'settingsRequested' in body_item and 'modelParameters' in body_item['settingsRequested']:
-            for var in body_item["settingsRequested"]["modelParameters"]:
-                if var['id'] == 'pdspi-guidance-sars:loc':
-                    location = var['parameterValue']['value']
-        age = None
-        weight = None
-        bmi = None
-        if 'settingsRequested' in body_item and 'patientVariables' in body_item['settingsRequested']:
-            for var in body_item['settingsRequested']["patientVariables"]:
-                if var['id'] == 'LOINC:30525-0':
-                    age = var["variableValue"]['value']
-                elif var['id'] == 'LOINC:29463-7':
-                    weight = var["variableValue"]['value']
-                elif var['id'] == 'LOINC:39156-5':
-                    bmi = var["variableValue"]['value']
-                inputs.append({
-                    "id": var["id"],
-                    "title": extract(var, "title"),
-                    "how": var["how"],
-                    "why": extract(var, "why"),
-                    "variableValue": var["variableValue"],
-                    "legalValues": extract(var, "legalValues"),
-                    "timestamp": var.get("timestamp", "2020-02-18T18:54:57.099Z")
-                })
-            ret_guidance.append({
-                **guidance,
-                "settingsUsed": {'patientVariables': inputs},
-                "advanced": generate_vis_outputs(age=age, weight=weight, bmi=bmi, location=location)
-            })
-    return ret_guidance
+        try:
+            params, age, weight, bmi, patient_inputs = _patient_settings(body_item, params, inputs)
+        except Exception as e:
+            in_flight.append((None, e))
+        else:
+            if patient_inputs is None:
+                continue
+            inputs = patient_inputs
+            in_flight.append((inputs, guidance_executor.submit(_patient_guidance, inputs, age, weight, bmi,
+                                                               params, shared_memo)))
+        while len(in_flight) >= queue:
+            yield _patient_result(*in_flight.popleft())
+    while in_flight:
+        yield _patient_result(*in_flight.popleft())
+
+
+def _patient_result(inputs, pending):
+    if isinstance(pending, Exception):
+        return _patient_error(inputs, pending)
+    try:
+        return pending.result()
+    except Exception as e:
+        return _patient_error(inputs, e)
+
+
+def _size_limit_error(n):
+    return _guidance_error("Guidance for {} patients exceeds the response limit of {} bytes".format(
+        n, cohort_max_bytes), "Split the cohort into smaller requests")
+
+
+def _stream_guidance(body, params=None):
+    size = 0
+    encoded = {}
+    for n, patient_guidance in enumerate(_iter_guidance(body, params), 1):
+        line = _encode_guidance(patient_guidance, encoded) + b"\n"
+        if cohort_mode and cohort_max_bytes:
+            size += len(line)
+            if size > cohort_max_bytes:
+                yield fastjson.dumps(_size_limit_error(n)[0]) + b"\n"
+                return
+        yield line
+
+
+def _accept():
+    """
+    read the Accept header, whose media types may carry a format parameter,
+    e.g. 'Accept: application/x-ndjson; format=compact'
+    :return: (best match of application/json and NDJSON, requested data format or None)
+    """
+    accept = []
+    data_format = None
+    for value, quality in request.accept_mimetypes:
+        mimetype, options = parse_options_header(value)
+        accept.append((mimetype, quality))
+        data_format = data_format or options.get("format")
+    return MIMEAccept(accept).best_match(["application/json", ndjson_mimetype], "application/json"), data_format
+
+
+def _complete(patient_guidance):
+    """
+    :return: False if the guidance of the patient failed or one of its specs is empty after a tx-vis error or
+    timeout, True otherwise
+    """
+    return "message" not in patient_guidance and all(output["specs"][0] for output in patient_guidance["advanced"])
+
+
+def _guidance_etag(mimetype, data_format, version):
+    """
+    :param version: data version served, see api.snapshot.data_version
+    :return: ETag of the guidance for the current request, which only changes with the config, the data version,
+    the response format, the query string and the request body
+    """
+    h = hashlib.sha1()
+    for part in (config_etag, version, mimetype, data_format or ""):
+        h.update(part.encode() + b"\0")
+    h.update(request.query_string + b"\0")
+    h.update(request.get_data())
+    return h.hexdigest()
+
+
+def get_guidance(body, outputs=None, start=None, end=None, last=None, resolution=None, points=None):
+    mimetype, data_format = _accept()
+    try:
+        output_ids = _output_ids(outputs)
+        series = _series_options({"start": start, "end": end, "last": last, "resolution": resolution,
+                                  "points": points})
+    except ValueError as e:
+        return _guidance_error(str(e), "Returned no guidance")
+    error = _model_parameter_error(body)
+    if error is not None:
+        return error
+    params = {"data_format": data_format, "output_ids": output_ids, "series": series}
+    etag = None
+    # a stream is sent before it is known whether every spec could be generated, so it is not tagged
+    if guidance_cacheable and mimetype != ndjson_mimetype:
+        version = data_version()
+        etag = _guidance_etag(mimetype, data_format, version)
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+
+    if mimetype == ndjson_mimetype:
+        return Response(_stream_guidance(body, params), mimetype=ndjson_mimetype)
+
+    ret_guidance = []
+    encoded = {}
+    size = 1
+    complete = True
+    for patient_guidance in _iter_guidance(body, params):
+        complete = complete and _complete(patient_guidance)
+        ret_guidance.append(_encode_guidance(patient_guidance, encoded))
+        size += len(ret_guidance[-1]) + 1
+        if cohort_mode and cohort_max_bytes and size > cohort_max_bytes:
+            return _size_limit_error(len(ret_guidance))
+    response = Response(b"[" + b",".join(ret_guidance) + b"]", mimetype="application/json")
+    # a snapshot reloaded during the request may have served data of a later version than the ETag's
+    if etag is not None and complete and data_version() == version:
+        response.set_etag(etag)
+    elif etag is not None:
+        # the same request may get other guidance once tx-vis answers again or the reload is done
+        response.headers["Cache-Control"] = "no-store"
+    return response
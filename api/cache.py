@@ -0,0 +1,172 @@
+"""
+Caches shared by the request handlers: LRUCache lives in the process, SQLiteCache in a file shared by all the
+workers on the host. single_flight coalesces concurrent identical calls to an expensive producer, so that a burst
+of cache misses computes the result once.
+"""
+import functools
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class LRUCache:
+    """
+    thread-safe LRU cache whose entries also expire ttl seconds after they were stored
+    :param maxsize: maximum number of entries, the least recently used one is evicted first
+    :param ttl: seconds an entry stays valid, None for no expiry
+    """
+    def __init__(self, maxsize=256, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            value, expires = item
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        return self.get(key, self) is not self
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteCache:
+    """
+    LRU cache stored in an SQLite file, so that every worker process on the host shares its entries and its
+    hit/miss counters. Keys are strings and values are pickled
+    :param file_name: path of the SQLite file, created if missing
+    :param maxsize: maximum number of entries, the least recently used ones are evicted first
+    """
+    def __init__(self, file_name, maxsize=1024):
+        self.file_name = file_name
+        self.maxsize = maxsize
+        self._local = threading.local()
+        with self._connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB, used REAL)")
+            db.execute("CREATE INDEX IF NOT EXISTS entries_used ON entries (used)")
+            db.execute("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, count INTEGER)")
+            db.execute("INSERT OR IGNORE INTO stats VALUES ('hits', 0), ('misses', 0)")
+
+    def _connect(self):
+        # one connection per thread, and a new one after a fork
+        db = getattr(self._local, "db", None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.file_name, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db, self._local.pid = db, os.getpid()
+        return db
+
+    def get(self, key, default=None):
+        with self._connect() as db:
+            row = db.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                db.execute("UPDATE stats SET count = count + 1 WHERE name = 'misses'")
+                return default
+            db.execute("UPDATE entries SET used = ? WHERE key = ?", (time.time(), key))
+            db.execute("UPDATE stats SET count = count + 1 WHERE name = 'hits'")
+        return pickle.loads(row[0])
+
+    def put(self, key, value):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._connect() as db:
+            db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?)", (key, blob, time.time()))
+            n, = db.execute("SELECT COUNT(*) FROM entries").fetchone()
+            if n > self.maxsize:
+                db.execute("DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY used LIMIT ?)",
+                           (n - self.maxsize,))
+
+    def clear(self):
+        with self._connect() as db:
+            db.execute("DELETE FROM entries")
+
+    def stats(self) -> dict:
+        """
+        :return: dict with the hits and misses counted by all workers so far and the current number of entries
+        """
+        db = self._connect()
+        out = dict(db.execute("SELECT name, count FROM stats").fetchall())
+        out["size"] = len(self)
+        return out
+
+    def __contains__(self, key):
+        return self._connect().execute("SELECT 1 FROM entries WHERE key = ?", (key,)).fetchone() is not None
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+
+class SingleFlight:
+    """
+    coalesce concurrent calls with the same key: the first caller runs the function, and the callers that arrive
+    while it is running wait for it and share its result or exception
+    """
+    def __init__(self):
+        self._reset()
+        # the threads running the calls in flight at a fork do not exist in the child, which must not wait for them
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+        if not leader:
+            return call.result()
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            self._done(key)
+            call.set_exception(e)
+            raise
+        self._done(key)
+        call.set_result(result)
+        return result
+
+    def _done(self, key):
+        with self._lock:
+            del self._calls[key]
+
+
+def single_flight(fn):
+    """
+    decorate fn so that concurrent calls with the same arguments run it once; arguments must be hashable and
+    the shared result must not be modified by the callers
+    """
+    flight = SingleFlight()
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        return flight.do((args, tuple(sorted(kwargs.items()))), fn, *args, **kwargs)
+    return wrapper
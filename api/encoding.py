@@ -0,0 +1,46 @@
+"""
+Columnar encoding of output data.
+
+Output data is a list of {x, y, group} points. The compact form stores one y column per group next to a single
+shared x axis (or one x column per group when the groups do not share it), with floats rounded to a number of
+significant digits:
+
+    {"format": "columnar", "x": [...], "groups": [{"group": "deaths", "y": [...]}, ...]}
+
+Points without a group are one group named null, and a column a chart does not use (e.g. y of a histogram) is
+left out.
+"""
+
+
+def _round(values, precision):
+    return [float("{:.{}g}".format(v, precision)) if isinstance(v, float) else v for v in values]
+
+
+def compact_data(points: list, precision=6) -> dict:
+    """
+    encode a list of points as columns per group
+    :param points: list of {x, y, group} dicts; y and group are optional
+    :param precision: significant digits kept for floats
+    :return: the columnar dict described in the module docstring
+    """
+    columns = {}
+    for p in points:
+        group = columns.setdefault(p.get('group'), {'x': [], 'y': []})
+        group['x'].append(p.get('x'))
+        if 'y' in p:
+            group['y'].append(p['y'])
+    xs = [c['x'] for c in columns.values()]
+    shared = len(xs) > 0 and all(x == xs[0] for x in xs[1:])
+    out = {"format": "columnar"}
+    if shared:
+        out["x"] = _round(xs[0], precision)
+    groups = []
+    for name, c in columns.items():
+        group = {"group": name}
+        if not shared:
+            group["x"] = _round(c['x'], precision)
+        if c['y']:
+            group["y"] = _round(c['y'], precision)
+        groups.append(group)
+    out["groups"] = groups
+    return out
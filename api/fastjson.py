@@ -0,0 +1,70 @@
+"""
+Fast JSON serialization.
+
+dumps encodes with orjson when it is installed and with the standard json module otherwise. install plugs it into
+Flask, and through flask.json into connexion's response serialization: as a JSONProvider on Flask 2.2 and later,
+and on older Flask, which has no providers, as a JSON encoder that at least handles numpy values. Parts of a
+response that never change are serialized once with dumps and spliced into responses as raw bytes.
+"""
+import json
+
+try:
+    from flask.json.provider import DefaultJSONProvider
+except ImportError:
+    DefaultJSONProvider = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(obj):
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    raise TypeError("Object of type {} is not JSON serializable".format(type(obj).__name__))
+
+
+def dumps(obj) -> bytes:
+    """
+    :return: obj serialized as compact UTF-8 JSON
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=_default, separators=(",", ":")).encode()
+
+
+class JSONEncoder(json.JSONEncoder):
+    """
+    JSON encoder for Flask before 2.2 that also encodes numpy values
+    """
+
+    def default(self, o):
+        return _default(o)
+
+
+if DefaultJSONProvider is not None:
+    class JSONProvider(DefaultJSONProvider):
+        """
+        Flask JSON provider that encodes with dumps; formatting arguments such as indent are ignored
+        """
+
+        def dumps(self, obj, **kwargs) -> str:
+            return dumps(obj).decode()
+
+        def loads(self, s, **kwargs):
+            if orjson is not None:
+                return orjson.loads(s)
+            return super().loads(s, **kwargs)
+else:
+    JSONProvider = None
+
+
+def install(flask_app):
+    """
+    serialize the JSON responses of flask_app with dumps, or with JSONEncoder on Flask before 2.2
+    """
+    if JSONProvider is not None:
+        flask_app.json = JSONProvider(flask_app)
+    else:
+        flask_app.json_encoder = JSONEncoder
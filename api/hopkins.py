@@ -0,0 +1,112 @@
+"""
+Local snapshot of the Johns Hopkins time series and the census population estimates.
+
+The three archived Hopkins CSVs and data/census.csv are downloaded and parsed once into a versioned binary
+snapshot (data/hopkins_census.npz, one array per column). Workers memory-map it once and serve get_hopkins and
+get_census from the mapped arrays. The snapshot is created on first use unless DATA_OFFLINE=1, in which case the network is
+never touched and a missing snapshot is an error.
+"""
+import csv
+import io
+import time
+from os import path
+from urllib.request import urlopen
+
+import numpy as np
+
+from api.snapshot import get_snapshot, load_npz, offline, publish
+
+
+hopkins_urls = {
+    "confirmed": "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/archived_data/archived_time_series/time_series_19-covid-Confirmed_archived_0325.csv",
+    "deaths": "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/archived_data/archived_time_series/time_series_19-covid-Deaths_archived_0325.csv",
+    "recovered": "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/archived_data/archived_time_series/time_series_19-covid-Recovered_archived_0325.csv",
+}
+census_file = 'data/census.csv'
+census_columns = ["NAME", "POPESTIMATE2019"]
+hopkins_file = 'data/hopkins_census.npz'
+
+
+def _read_data(url: str) -> dict:
+    response = urlopen(url)
+    byts = response.read()
+    data = io.StringIO(byts.decode())
+    reader = csv.DictReader(data)
+    result = {}
+    for row in reader:
+        for column, value in row.items():
+            result.setdefault(column, []).append(value)
+    return result
+
+
+def _convert_data(data: dict) -> dict:
+    out = {}
+    for k in list(data.keys())[:-1]:
+        if k in ["Province/State", "Country/Region"]:
+            out[k] = data[k]
+        elif k in ["Lat", "Long"]:
+            out[k] = list(map(float, data[k]))
+        else:
+            try:
+                out[k] = list(map(int, data[k]))
+            except ValueError:
+                out[k] = [0]
+    return out
+
+
+def _read_census(file_name=census_file) -> dict:
+    with open(file_name, newline='', encoding='latin-1') as f:
+        reader = csv.DictReader(f)
+        rows = [(row["NAME"], int(row["POPESTIMATE2019"])) for row in reader]
+    return {"NAME": [r[0] for r in rows], "POPESTIMATE2019": [r[1] for r in rows]}
+
+
+def download_snapshot(file_name=hopkins_file, census=census_file):
+    """
+    download the Hopkins CSVs, read the census and publish both as a new versioned snapshot
+    :param file_name: canonical path of the snapshot
+    :param census: path of the census csv
+    :return: path of the versioned snapshot
+    """
+    arrays = {}
+    sources = {series: _convert_data(_read_data(url)) for series, url in hopkins_urls.items()}
+    sources["census"] = _read_census(census)
+    for series, data in sources.items():
+        arrays[series + "_columns"] = np.array(list(data.keys()))
+        for i, values in enumerate(data.values()):
+            arrays["{}_{}".format(series, i)] = np.array(values)
+    buf = io.BytesIO()
+    np.savez(buf, **arrays)
+    return publish(file_name, time.strftime('%Y%m%d'), lambda fp: fp.write(buf.getvalue()), mode='wb')
+
+
+def _load(file_name) -> dict:
+    f = load_npz(file_name)
+    out = {}
+    for series in list(hopkins_urls.keys()) + ["census"]:
+        columns = f[series + "_columns"].tolist()
+        out[series] = {c: f["{}_{}".format(series, i)] for i, c in enumerate(columns)}
+    return out
+
+
+def get_store(file_name=hopkins_file) -> dict:
+    if not path.exists(file_name):
+        if offline:
+            raise RuntimeError("{} is missing and DATA_OFFLINE is set".format(file_name))
+        download_snapshot(file_name)
+    return get_snapshot(file_name, _load)
+
+
+def get_hopkins(file_name=hopkins_file) -> (dict, dict, dict):
+    """
+    :return: confirmed, deaths and recovered series, each a dict mapping column to its read-only array of values
+    """
+    store = get_store(file_name)
+    return (store[series] for series in hopkins_urls.keys())
+
+
+def get_census(file_name=hopkins_file) -> dict:
+    """
+    :return: dict with the NAME and POPESTIMATE2019 columns of the census
+    """
+    return get_store(file_name)["census"]
@@ -0,0 +1,161 @@
+"""
+Ingestion and per-worker store for the NYTimes state-level time series.
+
+us-states.csv is pivoted in one pass into a dense state x date matrix, from which every state's {x, y, group}
+points are written. Refreshes can append only the dates after the last stored one and are published as a new
+versioned snapshot swapped in atomically (see api.snapshot). The snapshot is parsed once per worker into a shared
+dates axis and dense cases and deaths matrices; looking up a state is a dict lookup plus a row view.
+"""
+import json
+from os import path
+from typing import TYPE_CHECKING
+
+import numpy as np
+from comodels.utils import states
+
+from api.snapshot import get_snapshot, publish
+
+
+nytimes_url = "https://raw.githubusercontent.com/nytimes/covid-19-data/master/us-states.csv"
+nytimes_file = 'data/multi_time_series_nytimes_data.json'
+groups = ('confirmed cases', 'deaths')
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+def read_nytimes_csv(src=nytimes_url) -> 'pd.DataFrame':
+    """
+    read the NYTimes us-states.csv
+    :param src: url or path of the csv
+    :return: DataFrame with date, state, cases and deaths columns
+    """
+    # pandas is only needed to ingest the csv, not to serve the snapshot
+    import pandas as pd
+    return pd.read_csv(src, usecols=['date', 'state', 'cases', 'deaths'])
+
+
+def pivot_nytimes_data(ori_data: 'pd.DataFrame', names=None) -> (np.ndarray, np.ndarray, np.ndarray):
+    """
+    turn NYTimes rows into dense state x date cases and deaths matrices in a single pivot
+    :param ori_data: DataFrame with date, state, cases and deaths columns
+    :param names: row order of the matrices, all states in comodels.utils.states by default. States missing from
+    the data get all-zero rows and dates a state did not report are 0
+    :return: (dates, cases, deaths) with dates in the order they appear in the data
+    """
+    if names is None:
+        names = list(states.values())
+    dates = ori_data['date'].unique()
+    wide = ori_data.drop_duplicates(['state', 'date']).pivot(index='state', columns='date',
+                                                             values=['cases', 'deaths'])
+    cases, deaths = (
+        wide[col].reindex(index=names, columns=dates).fillna(0).to_numpy(dtype=np.int64)
+        for col in ['cases', 'deaths']
+    )
+    return np.asarray(dates, dtype=str), cases, deaths
+
+
+def state_points(dates, cases, deaths) -> list:
+    """
+    build the {x, y, group} points of one state
+    :param dates: dates axis
+    :param cases: cases of the state on each date
+    :param deaths: deaths of the state on each date
+    :return: list of points, confirmed cases first, then deaths
+    """
+    dates = dates.tolist()
+    data = []
+    for key, values in zip(groups, (cases, deaths)):
+        data.extend({'x': date, 'y': value, 'group': key} for date, value in zip(dates, values.tolist()))
+    return data
+
+
+def get_state_data(ori_data: 'pd.DataFrame', names=None) -> dict:
+    """
+    build every state's points from NYTimes rows
+    :param ori_data: DataFrame with date, state, cases and deaths columns
+    :param names: states to build, all states in comodels.utils.states by default
+    :return: dict mapping state name to its list of points
+    """
+    if names is None:
+        names = list(states.values())
+    dates, cases, deaths = pivot_nytimes_data(ori_data, names)
+    return {name: state_points(dates, cases[row], deaths[row]) for row, name in enumerate(names)}
+
+
+def _load(file_name) -> dict:
+    """
+    parse a NYTimes JSON snapshot into columnar arrays
+    :param file_name: path of the snapshot, mapping state name to a list of {x, y, group} points
+    :return: dict with 'dates' (1-d str array), 'index' (state name -> row), 'cases' and 'deaths' (2-d int arrays)
+    """
+    with open(file_name) as f:
+        state_data = json.load(f)
+    dates = sorted({p['x'] for points in state_data.values() for p in points})
+    date_idx = {d: i for i, d in enumerate(dates)}
+    index = {name: i for i, name in enumerate(state_data.keys())}
+    columns = {group: np.zeros((len(index), len(dates)), dtype=np.int64) for group in groups}
+    for name, points in state_data.items():
+        row = index[name]
+        for p in points:
+            columns[p['group']][row, date_idx[p['x']]] = p['y']
+    for column in columns.values():
+        # workers forked from a preloading master share these pages as long as nothing writes to them
+        column.setflags(write=False)
+    return {
+        'dates': np.array(dates),
+        'index': index,
+        'cases': columns['confirmed cases'],
+        'deaths': columns['deaths']
+    }
+
+
+def get_store(file_name=nytimes_file) -> dict:
+    """
+    return the columnar store for the snapshot at file_name, see api.snapshot.get_snapshot
+    :param file_name: path of the NYTimes JSON snapshot
+    :return: the store dict described in _load
+    """
+    return get_snapshot(file_name, _load)
+
+
+def get_state_series(name, file_name=nytimes_file) -> (np.ndarray, np.ndarray, np.ndarray):
+    """
+    return the dates axis and the cases and deaths rows for one state; the rows are views, not copies
+    :param name: full state name, e.g. 'North Carolina'
+    :param file_name: path of the NYTimes JSON snapshot
+    :return: (dates, cases, deaths)
+    """
+    store = get_store(file_name)
+    row = store['index'][name]
+    return store['dates'], store['cases'][row], store['deaths'][row]
+
+
+def refresh_snapshot(file_name=nytimes_file, src=nytimes_url, incremental=False, keep=2):
+    """
+    rebuild the NYTimes snapshot and publish it atomically as a new version
+    :param file_name: canonical path of the snapshot
+    :param src: url or path of us-states.csv
+    :param incremental: only pivot the dates after the last one already in file_name and append them
+    :param keep: number of versioned snapshots to keep next to file_name
+    :return: the version (last date) of the published snapshot, or None if there was nothing new
+    """
+    ori_data = read_nytimes_csv(src)
+    if incremental and path.exists(file_name):
+        old = _load(file_name)
+        names = list(old['index'].keys())
+        last = old['dates'][-1]
+        ori_data = ori_data[ori_data['date'] > last]
+        if ori_data.empty:
+            return None
+        new_dates, new_cases, new_deaths = pivot_nytimes_data(ori_data, names)
+        dates = np.concatenate([old['dates'], new_dates])
+        cases = np.hstack([old['cases'], new_cases])
+        deaths = np.hstack([old['deaths'], new_deaths])
+    else:
+        names = list(states.values())
+        dates, cases, deaths = pivot_nytimes_data(ori_data, names)
+    state_data = {name: state_points(dates, cases[row], deaths[row]) for row, name in enumerate(names)}
+    version = str(dates[-1])
+    publish(file_name, version, lambda fp: json.dump(state_data, fp), keep=keep)
+    return version
@@ -0,0 +1,104 @@
+"""
+Precomputed per-state, per-scenario SIR and hospital projections.
+
+script/precompute_sir_projections.py runs the batched model (api.sir) offline for every state and a grid of social
+distancing rates and publishes the curves as one .npz snapshot. Each curve type is a (state, sds, group, day)
+block, so serving a projection is an index lookup with no model fitting or network I/O.
+"""
+import io
+
+import numpy as np
+
+from api.sir import penn_death_batch, sir_groups, hospital_groups
+from api.snapshot import get_snapshot, load_npz, publish
+
+
+projections_file = 'data/sir_projections.npz'
+sds_grid = np.round(np.arange(0, 1, 0.1), 2)
+types = {
+    'SIR': 'sir',
+    'Hospital Use': 'hospital_use',
+    'Hospital Census': 'hospital_census'
+}
+
+
+def build_projections(inputs: dict, sds=sds_grid, n_days=60) -> dict:
+    """
+    run the model for every state and social distancing rate in one batch
+    :param inputs: dict mapping state name to (N, I, R, D, doubling time), see api.utils.get_model_inputs. States
+    whose doubling time is not finite, e.g. with fewer than two days of cases, cannot be projected and are left out
+    :param sds: social distancing rates to project
+    :param n_days: number of days to project
+    :return: dict of arrays to save with save_projections
+    """
+    names = [n for n in inputs.keys() if np.isfinite(inputs[n][4])]
+    N, I, R, D, td = (np.array(col, dtype=float)[:, None] for col in zip(*(inputs[n] for n in names)))
+    sds = np.asarray(sds, dtype=float)
+    curve, occupancy = penn_death_batch(N, I, R, D, td, sds[None, :], n_days=n_days)
+    curves = {
+        'SIR': {k: curve[k] for k in sir_groups},
+        'Hospital Use': {k: curve[k] for k in hospital_groups},
+        'Hospital Census': occupancy
+    }
+    arrays = {'states': np.array(names), 'sds': sds}
+    for type, key in types.items():
+        groups = list(curves[type].keys())
+        block = np.full((len(names), len(sds), len(groups), n_days + 1), np.nan)
+        lengths = np.zeros(len(groups), dtype=np.int64)
+        for k, group in enumerate(groups):
+            values = curves[type][group]
+            block[:, :, k, :values.shape[-1]] = values
+            lengths[k] = values.shape[-1]
+        arrays[key] = block
+        arrays[key + '_groups'] = np.array(groups)
+        # curves of a type differ in length, the rest of each row is padding
+        arrays[key + '_lengths'] = lengths
+    return arrays
+
+
+def save_projections(arrays: dict, version, file_name=projections_file):
+    """
+    publish projections as a new versioned snapshot
+    :param arrays: dict of arrays from build_projections
+    :param version: version label of the snapshot
+    :param file_name: canonical path of the snapshot
+    """
+    buf = io.BytesIO()
+    np.savez(buf, **arrays)
+    publish(file_name, version, lambda fp: fp.write(buf.getvalue()), mode='wb')
+
+
+def _load(file_name) -> dict:
+    arrays = load_npz(file_name)
+    arrays['index'] = {n: i for i, n in enumerate(arrays['states'].tolist())}
+    return arrays
+
+
+def get_store(file_name=projections_file) -> dict:
+    return get_snapshot(file_name, _load)
+
+
+def get_projection(name, type='SIR', sds=0, file_name=projections_file):
+    """
+    look up the projection of one state
+    :param name: full state name, e.g. 'North Carolina'
+    :param type: 'SIR' or 'Hospital Use' or 'Hospital Census'
+    :param sds: social distance rate, the closest rate in the precomputed grid is used
+    :param file_name: path of the projections snapshot
+    :return: dict mapping group to its curve, or None if the state or type was not precomputed
+    """
+    store = get_store(file_name)
+    row = store['index'].get(name)
+    key = types.get(type)
+    if row is None or key is None:
+        return None
+    col = int(np.abs(store['sds'] - sds).argmin())
+    block = store[key][row, col]
+    groups = store[key + '_groups'].tolist()
+    if key + '_lengths' not in store:
+        # snapshots written before the lengths were stored
+        return {group: values[~np.isnan(values)] for group, values in zip(groups, block)}
+    return {
+        group: values[:length]
+        for group, values, length in zip(groups, block, store[key + '_lengths'].tolist())
+    }
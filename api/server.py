@@ -1,13 +1,34 @@
+import gc
+import os
+
 import connexion
 
 from tx.connexion.utils import ReverseProxied
 
+from api import fastjson
+
 def create_app():
     app = connexion.FlaskApp(__name__, specification_dir='openapi/')
     app.add_api('my_api.yaml')
     flask_app = app.app
+    fastjson.install(flask_app)
     proxied = ReverseProxied(
         flask_app.wsgi_app
     )
     flask_app.wsgi_app = proxied
+    if os.getenv("DATA_PRELOAD", "0") == "1":
+        from api.utils import preload_data
+        preload_data()
+        # keep the garbage collector from touching, and so copying, the objects loaded before the fork
+        gc.freeze()
+    if os.getenv("VIS_SPEC_PREWARM", "0") == "1":
+        import api
+        api.prewarm_vis_specs()
+    if os.getenv("WARMUP", "none") == "boot":
+        import api
+        if os.getenv("DATA_PRELOAD", "0") != "1":
+            api.start_warmup()
+        # with DATA_PRELOAD the app may be created in the gunicorn master, which must not warm up; each worker
+        # starts its own warmup with its first request, e.g. the first readiness check
+        flask_app.before_request(api.start_warmup)
     return app
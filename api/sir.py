@@ -0,0 +1,60 @@
+"""
+NumPy-batched PennDeath SIR/hospital-census integrator.
+
+penn_death_batch takes arrays of N, I, R, D, doubling time and contact reduction and integrates all of them at
+once, reproducing comodels.PennDeath(N, I, R, D, 0, ...).sir(n_days) for every element. Only the day loop runs in
+Python, so projecting every state for a grid of contact reductions costs about as much as a single PennDeath run.
+"""
+import numpy as np
+
+
+sir_groups = ['infected', 'recovered', 'susceptible', 'dead']
+hospital_groups = ['hospital', 'icu', 'ventilator']
+
+
+def _rolling_sum(a: np.ndarray, window: int) -> np.ndarray:
+    c = np.cumsum(a, axis=-1)
+    out = c[..., window - 1:].copy()
+    out[..., 1:] -= c[..., :-window]
+    return out
+
+
+def penn_death_batch(N, I, R, D, t_double, contact_reduction=0., n_days=60,
+                     hosp_rate=0.15, icu_rate=0.05, vent_rate=0.02, death_rate=0.01,
+                     hos_los=7, icu_los=9, vent_los=10, recover_time=23, birth_rate=0, beta_decay=0) -> (dict, dict):
+    """
+    run the PennDeath model (with no deaths today) for a batch of scenarios
+    :param N, I, R, D: population, infected, recovered and dead; arrays broadcast against each other
+    :param t_double: doubling time, broadcast against N
+    :param contact_reduction: contact reduced by social distancing within [0, 1), broadcast against N
+    :param n_days: number of days to project
+    :return: (curve, occupancy) like PennDeath.sir; every value has the broadcast batch shape plus a trailing day
+    axis of n_days + 1 points (fewer for occupancy, which is a rolling sum over the length of stay)
+    """
+    N, I, R, D, t_double, contact_reduction = np.broadcast_arrays(
+        *(np.asarray(x, dtype=float) for x in (N, I, R, D, t_double, contact_reduction)))
+    intrinsic_growth = 2 ** (1 / t_double) - 1
+    gamma = 1 / recover_time
+    S = N - (I + R + D)
+    beta = ((intrinsic_growth + gamma) / S) * (1 - contact_reduction)
+    mu = death_rate
+
+    shape = N.shape + (n_days + 1,)
+    s, i, r, d = (np.empty(shape) for _ in range(4))
+    s[..., 0], i[..., 0], r[..., 0], d[..., 0] = S, I, R, D
+    for day in range(1, n_days + 1):
+        Sn = np.maximum(birth_rate - mu * S - beta * S * I + S, 0)
+        Rn = np.maximum(gamma * I - mu * R + R, 0)
+        In = np.maximum(beta * S * I - (gamma * I - mu * I) + I, 0)
+        scale = N / (Sn + Rn + In)
+        S, I, R = Sn * scale, In * scale, Rn * scale
+        beta = beta * (1 - beta_decay)
+        s[..., day], i[..., day], r[..., day], d[..., day] = S, I, R, I * mu
+
+    curve = {'infected': i, 'recovered': r, 'susceptible': s, 'dead': d}
+    occupancy = {}
+    for k, rate, los in zip(hospital_groups, (hosp_rate, icu_rate, vent_rate), (hos_los, icu_los, vent_los)):
+        curve[k] = i * rate
+        admits = np.maximum(np.diff(curve[k], axis=-1), 0)
+        occupancy[k] = _rolling_sum(admits, los)
+    return curve, occupancy
@@ -0,0 +1,185 @@
+"""
+Helpers for versioned data snapshots under data/.
+
+A snapshot is written to a versioned file next to its canonical name and then swapped in with a hard link and
+os.replace, so readers opening the canonical name always see either the previous or the new snapshot in full,
+never a partially written file. Readers that still hold the previous file open keep reading it unchanged.
+
+Workers parse each snapshot once with get_snapshot. When the canonical file is replaced, the new snapshot is
+parsed in a background thread while callers keep getting the previous one.
+
+.npz snapshots are memory-mapped read-only with load_npz, so their arrays live in the page cache and are shared
+by every process on the host instead of being copied into each worker's heap.
+
+data_version summarizes the files every output is computed from, so that responses can be tagged with it. For a
+snapshot this worker has parsed it is the version being served, which lags the file while a reload is in progress.
+
+With DATA_OFFLINE=1 the data layer never downloads anything and only serves the snapshots already on disk.
+"""
+import glob
+import hashlib
+import os
+import struct
+import tempfile
+import threading
+import zipfile
+
+
+offline = os.getenv("DATA_OFFLINE", "0") == "1"
+
+_lock = threading.Lock()
+_snapshots = {}
+_reloading = set()
+
+
+def versioned_name(file_name, version):
+    root, ext = os.path.splitext(file_name)
+    return "{}.{}{}".format(root, version, ext)
+
+
+def atomic_write(file_name, write, mode='w'):
+    """
+    write a file so that it appears under file_name complete or not at all
+    :param file_name: destination path
+    :param write: callable taking the open file object
+    :param mode: 'w' for text or 'wb' for binary
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(file_name) or '.', prefix='.tmp-')
+    try:
+        with os.fdopen(fd, mode) as fp:
+            write(fp)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, file_name)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def publish(file_name, version, write, mode='w', keep=2):
+    """
+    write a new versioned snapshot and atomically make it the current one
+    :param file_name: canonical path readers open
+    :param version: version label of the snapshot, e.g. the last date it covers
+    :param write: callable taking the open file object
+    :param mode: 'w' for text or 'wb' for binary
+    :param keep: number of versioned snapshots to keep next to the canonical file
+    :return: path of the versioned snapshot
+    """
+    target = versioned_name(file_name, version)
+    atomic_write(target, write, mode)
+    tmp = "{}.{}.link".format(file_name, os.getpid())
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    os.link(target, tmp)
+    os.replace(tmp, file_name)
+    _prune(file_name, keep)
+    return target
+
+
+def _prune(file_name, keep):
+    root, ext = os.path.splitext(file_name)
+    old = sorted(glob.glob(glob.escape(root) + '.*' + ext), key=os.path.getmtime)
+    for name in old[:-keep] if keep > 0 else old:
+        os.remove(name)
+
+
+def file_version(file_name):
+    st = os.stat(file_name)
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+def load_npz(file_name) -> dict:
+    """
+    open an .npz written by np.savez with each array memory-mapped read-only from the file. Arrays that cannot
+    be mapped (compressed, object or empty arrays) are read into memory
+    :param file_name: path of the .npz
+    :return: dict mapping array name to array
+    """
+    # numpy is imported here so that importing api.snapshot, e.g. for data_version, stays cheap
+    import numpy as np
+    npy_headers = {
+        (1, 0): np.lib.format.read_array_header_1_0,
+        (2, 0): np.lib.format.read_array_header_2_0
+    }
+    arrays = {}
+    with zipfile.ZipFile(file_name) as z, open(file_name, 'rb') as f:
+        for info in z.infolist():
+            name = info.filename[:-len('.npy')] if info.filename.endswith('.npy') else info.filename
+            if info.compress_type == zipfile.ZIP_STORED:
+                # the member data follows its 30-byte local header, file name and extra field
+                f.seek(info.header_offset + 26)
+                name_len, extra_len = struct.unpack('<HH', f.read(4))
+                f.seek(info.header_offset + 30 + name_len + extra_len)
+                read_header = npy_headers.get(np.lib.format.read_magic(f))
+                if read_header is not None:
+                    shape, fortran_order, dtype = read_header(f)
+                    if not dtype.hasobject and 0 not in shape:
+                        arrays[name] = np.memmap(f, dtype=dtype, mode='r', offset=f.tell(), shape=shape,
+                                                 order='F' if fortran_order else 'C').view(np.ndarray)
+                        continue
+            with z.open(info) as member:
+                arrays[name] = np.lib.format.read_array(member)
+                arrays[name].setflags(write=False)
+    return arrays
+
+
+def data_version(data_dir='data') -> str:
+    """
+    version of the JSON data and the model snapshots under data_dir; it changes whenever one of them is replaced.
+    Snapshots parsed with get_snapshot count with the version that is served, not the one on disk, so the data
+    version only changes once their reload is done; the versioned copies kept next to them are ignored
+    :return: hex digest of the names and file versions
+    """
+    h = hashlib.sha1()
+    names = glob.glob(os.path.join(glob.escape(data_dir), '*.json')) + \
+        glob.glob(os.path.join(glob.escape(data_dir), '*.npz'))
+    versioned = {name for name in names for canonical in names if _is_versioned(name, canonical)}
+    loaded = {os.path.abspath(name): snapshot[0] for name, snapshot in list(_snapshots.items())}
+    for name in sorted(set(names) - versioned):
+        try:
+            version = loaded.get(os.path.abspath(name)) or file_version(name)
+        except FileNotFoundError:
+            # a file removed since the glob
+            continue
+        h.update(repr((name, version)).encode())
+    return h.hexdigest()
+
+
+def _is_versioned(name, canonical):
+    root, ext = os.path.splitext(canonical)
+    return name != canonical and name.startswith(root + '.') and name.endswith(ext)
+
+
+def _reload(file_name, load):
+    try:
+        version = file_version(file_name)
+        _snapshots[file_name] = (version, load(file_name))
+    finally:
+        with _lock:
+            _reloading.discard(file_name)
+
+
+def get_snapshot(file_name, load):
+    """
+    return the parsed snapshot at file_name; the first call parses it, later calls only stat the file
+    :param file_name: canonical path of the snapshot
+    :param load: callable parsing the file at the given path
+    :return: whatever load returned for the current or, while a reload is in progress, the previous version
+    """
+    snapshot = _snapshots.get(file_name)
+    if snapshot is None:
+        with _lock:
+            snapshot = _snapshots.get(file_name)
+            if snapshot is None:
+                version = file_version(file_name)
+                snapshot = _snapshots[file_name] = (version, load(file_name))
+        return snapshot[1]
+    if snapshot[0] != file_version(file_name):
+        with _lock:
+            if file_name not in _reloading:
+                _reloading.add(file_name)
+                threading.Thread(target=_reload, args=(file_name, load), daemon=True).start()
+    return snapshot[1]
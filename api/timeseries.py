@@ -0,0 +1,92 @@
+"""
+Windowing and downsampling of daily time series.
+
+All functions work on a sorted axis of ISO dates ('YYYY-MM-DD') and the value arrays on it, e.g. the cached rows
+of the NYTimes store, so bounding a series costs a binary search and a few array operations whatever the length of
+the history.
+"""
+import numpy as np
+
+
+resolutions = ('daily', 'weekly', 'lttb')
+
+
+def window(dates, columns, start=None, end=None, last=None):
+    """
+    slice a time series to a date range
+    :param dates: sorted ISO dates
+    :param columns: list of value arrays on dates
+    :param start: first date kept, inclusive
+    :param end: last date kept, inclusive
+    :param last: only keep the last this many days of the range
+    :return: (dates, columns), views of the inputs
+    """
+    dates = np.asarray(dates)
+    lo = np.searchsorted(dates, start, side='left') if start else 0
+    hi = np.searchsorted(dates, end, side='right') if end else len(dates)
+    if last is not None:
+        lo = max(lo, hi - last)
+    return dates[lo:hi], [c[lo:hi] for c in columns]
+
+
+def weekly(dates, columns):
+    """
+    one point per calendar week (Monday to Sunday): the last day of the week in the series. The NYTimes series
+    are cumulative totals, so this is the total at the end of each week
+    :return: (dates, columns)
+    """
+    dates = np.asarray(dates)
+    if len(dates) == 0:
+        return dates, columns
+    # 1970-01-01 was a Thursday, so day + 3 counts weeks from Monday
+    week = (dates.astype('datetime64[D]').astype(np.int64) + 3) // 7
+    ends = np.flatnonzero(np.append(week[1:] != week[:-1], True))
+    return dates[ends], [c[ends] for c in columns]
+
+
+def lttb(values, n) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets downsampling: pick n points of an evenly spaced series that keep its visual
+    shape. The first and last points are always kept
+    :param values: series values
+    :param n: number of points to keep
+    :return: sorted indices of the kept points
+    """
+    y = np.asarray(values, dtype=float)
+    size = len(y)
+    if n >= size or n < 3:
+        return np.arange(size)
+    x = np.arange(size, dtype=float)
+    every = (size - 2) / (n - 2)
+    kept = np.empty(n, dtype=np.int64)
+    kept[0], kept[-1] = 0, size - 1
+    a = 0
+    for i in range(n - 2):
+        lo, hi = int(i * every) + 1, int((i + 1) * every) + 1
+        next_lo, next_hi = hi, min(int((i + 2) * every) + 1, size)
+        avg_x, avg_y = x[next_lo:next_hi].mean(), y[next_lo:next_hi].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(area.argmax())
+        kept[i + 1] = a
+    return kept
+
+
+def resample(dates, columns, start=None, end=None, last=None, resolution='daily', points=200):
+    """
+    window a time series and reduce its resolution
+    :param dates: sorted ISO dates
+    :param columns: list of value arrays on dates
+    :param start, end, last: see window
+    :param resolution: 'daily' keeps every day, 'weekly' one point per week, 'lttb' at most points points per
+    column chosen with lttb
+    :param points: number of points per column for 'lttb'
+    :return: list of (dates, values) per column; with 'lttb' each column keeps its own dates
+    """
+    if resolution not in resolutions:
+        raise ValueError("unknown resolution {}, expected one of {}".format(resolution, ', '.join(resolutions)))
+    dates, columns = window(dates, columns, start, end, last)
+    if resolution == 'weekly':
+        dates, columns = weekly(dates, columns)
+    if resolution == 'lttb':
+        return [(dates[kept], c[kept]) for c in columns for kept in [lttb(c, points)]]
+    return [(dates, c) for c in columns]
@@ -1,132 +1,68 @@
 from random import seed, random
-import csv
-import io
-import math
 import json
 from os import path
-from typing import Any, Dict, List
-from urllib.request import urlopen
-import pandas as pd
-from sklearn.linear_model import LinearRegression
+from typing import Any, Dict, List, TYPE_CHECKING
 import numpy as np
-from comodels import PennDeath
 from comodels.utils import states
+from api import nytimes, projections, hopkins
+from api.nytimes import nytimes_file, groups, get_state_series, state_points, read_nytimes_csv, pivot_nytimes_data
+from api.projections import projections_file, get_projection
+from api.hopkins import hopkins_file, get_hopkins, get_census
+from api.growth import growth_rates
+from api.timeseries import resample
+from api.snapshot import offline
+from api.cache import single_flight
+
+if TYPE_CHECKING:
+    import pandas as pd
 
 
 def _get_random(min_num, max_num):
     return random() * (max_num - min_num) + min_num
 
 
-def _read_data(url: str) -> dict:
-    response = urlopen(url)
-    byts = response.read()
-    data = io.StringIO(byts.decode())
-    reader = csv.DictReader(data)
-    result = {}
-    for row in reader:
-        for column, value in row.items():
-            result.setdefault(column, []).append(value)
-    return result
-
-
-def _convert_data(data: dict) -> dict:
-    out = {}
-    for k in list(data.keys())[:-1]:
-        if k in ["Province/State", "Country/Region"]:
-            out[k] = data[k]
-        elif k in ["Lat", "Long"]:
-            out[k] = list(map(float, data[k]))
-        else:
-            try:
-                out[k] = list(map(int, data[k]))
-            except ValueError:
-                out[k] = [0]
-    return out
-
-
-def _read_nytimes_data(url:str) -> (dict, dict):
-    response = urlopen(url)
-    byts = response.read()
-    data = io.StringIO(byts.decode())
-    ori_data = pd.read_csv(data).drop('fips', axis=1)
-    dates = ori_data.date.unique()
-    cases = {}
-    deaths = {}
-    for name in states.values():
-        df_filter = ori_data['state'] == name
-        filter_data = ori_data[df_filter]
-        cases.setdefault('state', []).append(name)
-        deaths.setdefault('state', []).append(name)
-        for date in dates:
-            if date in filter_data.date.unique():
-                cases.setdefault(date, []).append(filter_data[filter_data.date == date].iloc[0]['cases'])
-                deaths.setdefault(date, []).append(filter_data[filter_data.date == date].iloc[0]['deaths'])
-            else:
-                cases.setdefault(date, []).append(0)
-                deaths.setdefault(date, []).append(0)
-    return (cases, deaths)
-
-
-def _convert_nytimes_data(data: dict) -> dict:
-    out = {}
-    for k in list(data.keys()):
-        if k == "state":
-            out[k] = data[k]
-        else:
-            try:
-                out[k] = list(map(int, data[k]))
-            except ValueError:
-                out[k] = [0]
-    return out
-
-
-def get_nytimes_state_level(d: dict) -> dict:
-    idx = [
-        i for i in range(len(d["state"]))
-    ]
-    return {k: np.array(v)[idx] for k, v in d.items()}
-
-
-def get_multi_time_series_nytimes_data(state='NC'):
-    file_name = 'data/multi_time_series_nytimes_data.json'
+@single_flight
+def get_multi_time_series_nytimes_data(state='NC', start=None, end=None, last=None, resolution='daily', points=200):
+    """
+    Get the NYTimes cases and deaths points of one state
+    :param state: state abbreviation
+    :param start, end, last, resolution, points: window and resolution of the series, see api.timeseries.resample
+    :return: list of {x, y, group} points, confirmed cases first, then deaths
+    """
+    file_name = nytimes_file
+    n = states[state]
     if path.exists(file_name):
-        with open(file_name) as f:
-            state_data = json.load(f)
-            # print('load nytimes data from file', flush=True)
-            n = states[state]
-            return state_data[n]
+        dates, cases, deaths = get_state_series(n, file_name)
+    elif offline:
+        raise RuntimeError("{} is missing and DATA_OFFLINE is set".format(file_name))
     else:
-        data = []
-        n = states[state]
-        datafile = "https://raw.githubusercontent.com/nytimes/covid-19-data/master/us-states.csv"
-        (cases_dict, deaths_dict) = _read_nytimes_data(datafile)
-        cases_df = pd.DataFrame.from_dict(get_nytimes_state_level(_convert_nytimes_data(cases_dict)))
-        deaths_df = pd.DataFrame.from_dict(get_nytimes_state_level(_convert_nytimes_data(deaths_dict)))
-        case_df_filter = cases_df['state'] == n
-        death_df_filter = deaths_df['state'] == n
-        out = {
-            'confirmed cases': cases_df[case_df_filter].drop('state', axis=1),
-            'deaths': deaths_df[death_df_filter].drop('state', axis=1)
-        }
-        # Generate all the traces.
-        # Each distancing rate is a different plot, which is made visible with the update buttons
-        for key, df_values in out.items():
-            for date, value in df_values.items():
-                data.append({
-                    'x': date,
-                    'y': int(value),
-                    'group': key
-                })
-        return data
+        dates, cases, deaths = pivot_nytimes_data(read_nytimes_csv(), [n])
+        cases, deaths = cases[0], deaths[0]
+    if start is None and end is None and last is None and resolution == 'daily':
+        return state_points(dates, cases, deaths)
+    data = []
+    for group, (x, y) in zip(groups, resample(dates, [cases, deaths], start, end, last, resolution, points)):
+        data.extend({'x': d, 'y': v, 'group': group} for d, v in zip(x.tolist(), y.tolist()))
+    return data
 
 
-def get_hopkins() -> (dict, dict, dict):
-    datafiles = [
-        "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/archived_data/archived_time_series/time_series_19-covid-Confirmed_archived_0325.csv",
-        "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/archived_data/archived_time_series/time_series_19-covid-Deaths_archived_0325.csv",
-        "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/archived_data/archived_time_series/time_series_19-covid-Recovered_archived_0325.csv",
-    ]
-    return (_convert_data(_read_data(dat)) for dat in datafiles)
+def preload_data() -> list:
+    """
+    load the NYTimes, projection and Hopkins/census snapshots that exist under data/ into this process, so that
+    workers forked from it afterwards share them instead of loading their own copies
+    :return: paths of the snapshots loaded
+    """
+    # imported lazily elsewhere; import them here too so that the workers share them as well
+    import pandas  # noqa: F401
+    import comodels  # noqa: F401
+    loaded = []
+    for file_name, get_store in [(nytimes_file, nytimes.get_store),
+                                 (projections_file, projections.get_store),
+                                 (hopkins_file, hopkins.get_store)]:
+        if path.exists(file_name):
+            get_store(file_name)
+            loaded.append(file_name)
+    return loaded
 
 
 def get_state_level(d: dict) -> dict:
@@ -139,56 +75,57 @@ def get_state_level(d: dict) -> dict:
 
 
 # get the growth rate from the data
-def get_slope(X: pd.DataFrame) -> float:
-    lm = LinearRegression()
-    lm.fit(
-        np.arange(X.shape[0]).reshape(-1, 1),
-        X.apply(lambda x: math.log(x) if x != 0 else x),
-    )
-    return lm.coef_[0]
+def get_slope(X: 'pd.Series') -> float:
+    return float(growth_rates(X.to_numpy()))
 
 
 def doubling_time(gr: float) -> float:
     return 1 / np.log2(1 + gr)
 
 
-def _get_model_data(state='NC', type='SIR', sds=0):
+def get_model_inputs(names=None, window=None) -> dict:
     """
-    Get model output data
-    :param state: name of the state to return data for
-    :param type: 'SIR' or 'Hospital Use' or 'Hospital Census'
-    :param sds: social distance rate within [0, 1] with 0 meaning no social distancing and 1 meaning maximal
-    social distancing
-    :return:
+    Get the PennDeath inputs of every state from the Hopkins and census data
+    :param names: names of the states to return inputs for, all states with census and Hopkins data by default
+    :param window: only use the last window days of confirmed cases to estimate the doubling time
+    :return: dict mapping state name to (N, I, R, D, doubling time)
     """
-    n = states[state]
-    census = pd.read_csv("data/census.csv")
-    pops = census[["NAME", "POPESTIMATE2019"]]
-    nms = pops["NAME"]
-    t_recovery = 23
+    # pandas is only needed when the model inputs are not precomputed, so it is imported here
+    import pandas as pd
+    pops = pd.DataFrame(get_census())
     conf, dead, rec = (
         pd.DataFrame.from_dict(get_state_level(x)).drop(
             ["Lat", "Long", "Country/Region"], axis=1
         )
         for x in get_hopkins()
     )
-    # the zeros mess up our slope
-    state_conf = conf[conf['Province/State'] == n]
-    data = state_conf.drop("Province/State", axis=1)
-    data = data.iloc[0]
-    data = data.loc[data != 0]
-    state_growth = get_slope(data)
-    td = doubling_time(state_growth)
     new_names = {i: v for i, v in enumerate(conf["Province/State"])}
-    c_tot, d_tot, r_tot = (x.sum(1).rename(new_names) for x in [conf, dead, rec])
+    c_tot, d_tot, r_tot = (x.sum(axis=1, numeric_only=True).rename(new_names) for x in [conf, dead, rec])
+    if names is None:
+        names = [n for n in states.values() if n in c_tot.index and n in pops["NAME"].values]
+
+    # one growth rate per Hopkins row; zeros are masked out by growth_rates
+    td = doubling_time(growth_rates(conf.drop("Province/State", axis=1).to_numpy(), window))
+    rows = {}
+    for i, n in enumerate(conf["Province/State"]):
+        rows.setdefault(n, i)
+    pop = dict(zip(pops["NAME"], pops["POPESTIMATE2019"]))
+    return {n: (pop[n], c_tot[n], r_tot[n], d_tot[n], td[rows[n]]) for n in names}
 
-    state_curve = {}
-    N = pops[pops["NAME"] == n]["POPESTIMATE2019"].values[0]
-    I = c_tot[n]
-    R = r_tot[n]
-    D = d_tot[n]
+
+def get_state_curve(N, I, R, D, td, sds=0, n_days=60) -> dict:
+    """
+    Run the PennDeath model for one state
+    :param N, I, R, D: population, infected, recovered and dead
+    :param td: doubling time
+    :param sds: social distance rate within [0, 1)
+    :param n_days: number of days to project
+    :return: dict with 'SIR', 'Hospital Use' and 'Hospital Census' curves
+    """
+    from comodels import PennDeath
+    t_recovery = 23
     model = PennDeath(N, I, R, D, 0, contact_reduction=sds, t_double=td, recover_time=t_recovery)
-    curve, occ = model.sir(60)
+    curve, occ = model.sir(n_days)
     sir = {
         k: v
         for k, v in curve.items()
@@ -199,10 +136,24 @@ def _get_model_data(state='NC', type='SIR', sds=0):
         for k, v in curve.items()
         if k not in ["susceptible", "infected", "recovered", "dead"]
     }
-    state_curve = {"SIR": sir, "Hospital Use": hosp_use, "Hospital Census": occ}
-    return state_curve
+    return {"SIR": sir, "Hospital Use": hosp_use, "Hospital Census": occ}
+
+
+@single_flight
+def _get_model_data(state='NC', type='SIR', sds=0):
+    """
+    Get model output data
+    :param state: name of the state to return data for
+    :param type: 'SIR' or 'Hospital Use' or 'Hospital Census'
+    :param sds: social distance rate within [0, 1] with 0 meaning no social distancing and 1 meaning maximal
+    social distancing
+    :return:
+    """
+    n = states[state]
+    return get_state_curve(*get_model_inputs([n])[n], sds=sds)
 
 
+@single_flight
 def get_multi_time_series_data(state='NC', type='SIR', sds=0):
     """
 
@@ -213,6 +164,12 @@ def get_multi_time_series_data(state='NC', type='SIR', sds=0):
     :return:
     """
     data = []
+    if path.exists(projections_file):
+        out = get_projection(states[state], type, sds)
+        if out is not None:
+            for key, values in out.items():
+                data.extend({'x': i, 'y': y, 'group': key} for i, y in enumerate(values.tolist()))
+            return data
     file_name = ''
     if type == 'SIR':
         file_name = 'data/sir_patient_prediction_data.json'
@@ -0,0 +1,76 @@
+"""
+Local Vega-Lite spec templates for the chart types requested from tx-vis.
+
+Each chart type has a skeleton that only needs its titles, description and time unit filled in. The data is not
+part of the spec; clients bind each output's data to the named "data" source.
+"""
+import copy
+
+
+vega_lite_schema = "https://vega.github.io/schema/vega-lite/v4.json"
+
+_skeletons = {
+    "multiple_line_chart": {
+        "$schema": vega_lite_schema,
+        "width": "container",
+        "data": {"name": "data"},
+        "mark": {"type": "line", "tooltip": True},
+        "encoding": {
+            "x": {"field": "x", "type": "quantitative"},
+            "y": {"field": "y", "type": "quantitative"},
+            "color": {"field": "group", "type": "nominal", "title": None}
+        }
+    },
+    "scatter_plot": {
+        "$schema": vega_lite_schema,
+        "width": "container",
+        "data": {"name": "data"},
+        "mark": {"type": "point", "tooltip": True},
+        "encoding": {
+            "x": {"field": "x", "type": "quantitative"},
+            "y": {"field": "y", "type": "quantitative"}
+        }
+    },
+    "multiple_scatter_plot": {
+        "$schema": vega_lite_schema,
+        "width": "container",
+        "data": {"name": "data"},
+        "mark": {"type": "point", "tooltip": True},
+        "encoding": {
+            "x": {"field": "x", "type": "quantitative"},
+            "y": {"field": "y", "type": "quantitative"},
+            "color": {"field": "group", "type": "nominal", "title": None},
+            "shape": {"field": "group", "type": "nominal", "title": None}
+        }
+    },
+    "histogram": {
+        "$schema": vega_lite_schema,
+        "width": "container",
+        "data": {"name": "data"},
+        "mark": {"type": "bar", "tooltip": True},
+        "encoding": {
+            "x": {"field": "x", "type": "quantitative", "bin": True},
+            "y": {"aggregate": "count", "type": "quantitative"}
+        }
+    }
+}
+
+
+def vega_spec(typeid, x_axis_title, y_axis_title, chart_title, chart_desc, time_unit=''):
+    """
+    render a Vega-Lite spec locally, taking the same arguments as api.generate_vis_spec
+    :return: the spec, or {} for an unknown typeid
+    """
+    skeleton = _skeletons.get(typeid)
+    if skeleton is None:
+        return {}
+    spec = copy.deepcopy(skeleton)
+    spec["title"] = chart_title
+    spec["description"] = chart_desc
+    encoding = spec["encoding"]
+    encoding["x"]["title"] = x_axis_title
+    encoding["y"]["title"] = y_axis_title
+    if time_unit:
+        encoding["x"]["type"] = "temporal"
+        encoding["x"]["timeUnit"] = time_unit
+    return spec
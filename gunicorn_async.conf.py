@@ -0,0 +1,22 @@
+"""
+gunicorn settings for the async serving mode:
+
+    gunicorn -c gunicorn_async.conf.py "api.server:create_app()"
+
+Each worker is a gevent worker that serves up to WORKER_CONNECTIONS requests concurrently as greenlets. The worker
+monkey-patches the standard library before it imports the app, so the outbound tx-vis requests (requests, urllib3)
+and the vis spec thread pool yield to other requests while they wait on the network instead of blocking the
+worker. Model and data work is still CPU bound and runs one request at a time per worker.
+
+The app must therefore not be imported before the workers fork: do not combine this mode with --preload.
+"""
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:8080")
+workers = int(os.getenv("WORKERS", "4"))
+worker_class = "gevent"
+worker_connections = int(os.getenv("WORKER_CONNECTIONS", "500"))
+timeout = int(os.getenv("WORKER_TIMEOUT", "60"))
+
+# let every connection of a worker wait on tx-vis at the same time; the vis spec "threads" are greenlets here
+os.environ.setdefault("VIS_SPEC_WORKERS", str(worker_connections))
@@ -0,0 +1,16 @@
+import argparse
+import sys
+from os import path
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from api.hopkins import download_snapshot
+
+
+parser = argparse.ArgumentParser(description='Snapshot the Johns Hopkins time series and the census estimates.')
+parser.add_argument('--output', default='/usr/src/app/data/hopkins_census.npz',
+                    help='canonical path of the snapshot the api reads')
+parser.add_argument('--census', default='/usr/src/app/data/census.csv', help='path of the census csv')
+args = parser.parse_args()
+
+print('snapshot {}'.format(download_snapshot(args.output, args.census)))
@@ -0,0 +1,53 @@
+import argparse
+import subprocess
+import sys
+from collections import defaultdict
+from os import path
+
+app_root = path.dirname(path.dirname(path.abspath(__file__)))
+
+
+def import_times(module):
+    """
+    import module in a fresh interpreter with -X importtime
+    :return: (dict mapping top-level package to the microseconds spent importing its modules, set of modules imported)
+    """
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                          cwd=app_root, capture_output=True, text=True, check=True)
+    totals = defaultdict(int)
+    modules = set()
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        name = name.strip()
+        modules.add(name)
+        totals[name.split('.')[0]] += int(self_us)
+    return totals, modules
+
+
+parser = argparse.ArgumentParser(description='Report the time spent importing the api package, per top-level '
+                                             'package, and fail if it exceeds the budget.')
+parser.add_argument('--module', default='api', help='module to import')
+parser.add_argument('--runs', type=int, default=3, help='number of imports; the fastest one is reported')
+parser.add_argument('--budget-ms', type=float, default=500, help='maximum total import time in milliseconds')
+parser.add_argument('--forbid', default='pandas,sklearn,comodels',
+                    help='comma separated packages that importing the module must not import')
+parser.add_argument('--top', type=int, default=15, help='number of packages to list')
+args = parser.parse_args()
+
+totals, modules = min((import_times(args.module) for _ in range(args.runs)), key=lambda r: sum(r[0].values()))
+total_ms = sum(totals.values()) / 1000
+for package, us in sorted(totals.items(), key=lambda kv: -kv[1])[:args.top]:
+    print('{:>10.1f} ms  {}'.format(us / 1000, package))
+print('{:>10.1f} ms  total for import {}'.format(total_ms, args.module))
+
+errors = []
+if total_ms > args.budget_ms:
+    errors.append('import time {:.1f} ms exceeds the budget of {:.0f} ms'.format(total_ms, args.budget_ms))
+forbidden = [p for p in args.forbid.split(',') if p and p in modules]
+if forbidden:
+    errors.append('import {} loads {}'.format(args.module, ', '.join(forbidden)))
+for error in errors:
+    print(error, file=sys.stderr)
+sys.exit(1 if errors else 0)
@@ -0,0 +1,26 @@
+import argparse
+import sys
+import time
+from os import path
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from api.projections import build_projections, save_projections, sds_grid
+from api.utils import get_model_inputs
+
+
+parser = argparse.ArgumentParser(description='Precompute SIR and hospital projections for every state.')
+parser.add_argument('--output', default='/usr/src/app/data/sir_projections.npz',
+                    help='canonical path of the projections snapshot the api reads')
+parser.add_argument('--sds', type=float, nargs='+', default=sds_grid.tolist(),
+                    help='social distancing rates to project, each within [0, 1)')
+parser.add_argument('--days', type=int, default=60, help='number of days to project')
+args = parser.parse_args()
+
+inputs = get_model_inputs()
+arrays = build_projections(inputs, sds=args.sds, n_days=args.days)
+save_projections(arrays, time.strftime('%Y%m%d'), args.output)
+print('projected {} states x {} rates'.format(len(arrays['states']), len(arrays['sds'])))
+skipped = sorted(set(inputs) - set(arrays['states'].tolist()))
+if skipped:
+    print('skipped states without a finite doubling time: {}'.format(', '.join(skipped)))
@@ -0,0 +1,60 @@
+import argparse
+import os
+
+
+def children(pid):
+    with open('/proc/{}/task/{}/children'.format(pid, pid)) as f:
+        return [int(c) for c in f.read().split()]
+
+
+def find_master():
+    for pid in sorted(int(p) for p in os.listdir('/proc') if p.isdigit()):
+        try:
+            with open('/proc/{}/cmdline'.format(pid), 'rb') as f:
+                cmdline = f.read().split(b'\0')
+            with open('/proc/{}/stat'.format(pid)) as f:
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except OSError:
+            continue
+        if any(b'gunicorn' in arg for arg in cmdline[:2]):
+            with open('/proc/{}/cmdline'.format(ppid), 'rb') as f:
+                if b'gunicorn' not in f.read():
+                    return pid
+    return None
+
+
+def memory(pid):
+    """
+    :return: dict of Rss, Pss and Uss (private clean + private dirty) in kB
+    """
+    fields = {}
+    with open('/proc/{}/smaps_rollup'.format(pid)) as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1])
+    return {
+        'Rss': fields['Rss'],
+        'Pss': fields['Pss'],
+        'Uss': fields['Private_Clean'] + fields['Private_Dirty']
+    }
+
+
+parser = argparse.ArgumentParser(description='Report the memory of the gunicorn master and of each of its workers; '
+                                             'Uss is the memory unique to a process, not shared with the others.')
+parser.add_argument('--pid', type=int, help='pid of the gunicorn master, found in /proc by default')
+args = parser.parse_args()
+
+master = args.pid or find_master()
+if master is None:
+    parser.error('no gunicorn master found')
+total = {'Rss': 0, 'Pss': 0, 'Uss': 0}
+print('{:>8} {:>8} {:>10} {:>10} {:>10}'.format('', 'pid', 'Rss MiB', 'Pss MiB', 'Uss MiB'))
+for role, pid in [('master', master)] + [('worker', pid) for pid in children(master)]:
+    m = memory(pid)
+    for k in total:
+        total[k] += m[k]
+    print('{:>8} {:>8} {:>10.1f} {:>10.1f} {:>10.1f}'.format(role, pid, m['Rss'] / 1024, m['Pss'] / 1024,
+                                                             m['Uss'] / 1024))
+print('{:>8} {:>8} {:>10.1f} {:>10.1f} {:>10.1f}'.format('total', '', total['Rss'] / 1024, total['Pss'] / 1024,
+                                                         total['Uss'] / 1024))
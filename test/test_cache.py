@@ -0,0 +1,68 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from api.cache import LRUCache, SQLiteCache, single_flight
+
+
+def test_lru_cache_evicts_the_least_recently_used_entry():
+    cache = LRUCache(maxsize=2)
+    cache.put("x", 1)
+    cache.put("y", 2)
+    assert cache.get("x") == 1
+    cache.put("z", 3)
+    assert "x" in cache and "z" in cache and "y" not in cache
+    cache.put("x", 4)
+    cache.put("w", 5)
+    assert len(cache) == 2 and cache.get("x") == 4 and cache.get("z") is None
+
+
+def test_lru_cache_entries_expire_after_the_ttl():
+    cache = LRUCache(ttl=0.5)
+    cache.put("x", 1)
+    assert cache.get("x") == 1
+    time.sleep(0.25)
+    cache.put("y", 2)
+    # reading an entry does not extend its lifetime
+    time.sleep(0.35)
+    assert cache.get("x", "expired") == "expired" and cache.get("y") == 2
+    time.sleep(0.25)
+    assert "y" not in cache and len(cache) == 0
+
+
+def test_sqlite_cache_is_shared_and_bounded(tmp_path):
+    file_name = str(tmp_path / "cache.sqlite")
+    a = SQLiteCache(file_name, maxsize=2)
+    b = SQLiteCache(file_name, maxsize=2)
+    a.put("x", [{"id": "oid-1"}])
+    assert b.get("x") == [{"id": "oid-1"}]
+    assert b.get("y") is None
+    b.put("y", 1)
+    a.get("x")
+    a.put("z", 2)
+    assert "x" in b and "z" in b and "y" not in b
+    assert a.stats() == {"hits": 2, "misses": 1, "size": 2}
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    calls = []
+    started = threading.Event()
+    release = threading.Event()
+
+    @single_flight
+    def produce(x):
+        calls.append(x)
+        started.set()
+        release.wait(5)
+        return [x]
+
+    with ThreadPoolExecutor(8) as pool:
+        leader = pool.submit(produce, 1)
+        started.wait(5)
+        followers = [pool.submit(produce, 1) for _ in range(6)]
+        time.sleep(0.2)
+        release.set()
+        results = [f.result() for f in [leader] + followers]
+    assert calls == [1]
+    assert all(r is results[0] for r in results)
+    assert produce(1) == [1] and calls == [1, 1]
@@ -0,0 +1,37 @@
+from os import path
+
+import yaml
+from jsonschema import Draft4Validator
+
+from api.encoding import compact_data
+
+
+def test_compact_data_shares_x_axis():
+    points = [
+        {"x": d, "y": v, "group": g}
+        for g, vs in [("confirmed cases", [1, 2]), ("deaths", [0.123456789, 0.5])]
+        for d, v in zip(["2020-03-01", "2020-03-02"], vs)
+    ]
+    assert compact_data(points, precision=3) == {
+        "format": "columnar",
+        "x": ["2020-03-01", "2020-03-02"],
+        "groups": [{"group": "confirmed cases", "y": [1, 2]}, {"group": "deaths", "y": [0.123, 0.5]}]
+    }
+
+
+def test_compact_data_separate_x_without_y():
+    points = [{"x": 1.0}, {"x": 2.5, "group": "a"}]
+    assert compact_data(points) == {
+        "format": "columnar",
+        "groups": [{"group": None, "x": [1.0]}, {"group": "a", "x": [2.5]}]
+    }
+
+
+def test_both_data_formats_match_the_output_schema():
+    with open(path.join(path.dirname(path.dirname(path.abspath(__file__))), "api", "openapi", "my_api.yaml")) as f:
+        components = yaml.safe_load(f)["components"]
+    validator = Draft4Validator({"$ref": "#/components/schemas/Output", "components": components})
+    points = [{"x": "2020-03-01", "y": 1, "group": "deaths"}, {"x": 1.0}]
+    for data in [points, compact_data(points)]:
+        validator.validate({"id": "oid-1", "data": data})
+    assert not validator.is_valid({"id": "oid-1", "data": {"format": "rows"}})
@@ -0,0 +1,28 @@
+import json
+import types
+
+import numpy as np
+
+import api
+from api import fastjson
+
+
+def test_dumps_numpy():
+    assert json.loads(fastjson.dumps({"y": np.arange(3), 1: np.float64(0.5)})) == {"y": [0, 1, 2], "1": 0.5}
+
+
+def test_encode_guidance_matches_plain_json():
+    output = {"id": "oid-1", "data": [{"x": "2020-03-01", "y": 1.5, "group": "deaths"}]}
+    patient_guidance = {**api.guidance, "settingsUsed": {"patientVariables": []}, "advanced": [output, output]}
+    encoded = {}
+    assert json.loads(api._encode_guidance(patient_guidance, encoded)) == patient_guidance
+    assert len(encoded) == 1
+    assert json.loads(api._encode_guidance({"message": []})) == {"message": []}
+
+
+def test_install_without_json_providers(monkeypatch):
+    # Flask before 2.2 has no flask.json.provider
+    monkeypatch.setattr(fastjson, "JSONProvider", None)
+    app = types.SimpleNamespace()
+    fastjson.install(app)
+    assert json.loads(json.dumps({"y": np.arange(2)}, cls=app.json_encoder)) == {"y": [0, 1]}
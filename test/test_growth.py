@@ -0,0 +1,30 @@
+import math
+
+import numpy as np
+from sklearn.linear_model import LinearRegression
+
+from api.growth import growth_rates
+
+
+def _sklearn_slope(row):
+    row = row[row != 0]
+    lm = LinearRegression()
+    lm.fit(np.arange(row.shape[0]).reshape(-1, 1), [math.log(x) for x in row])
+    return lm.coef_[0]
+
+
+def test_growth_rates_match_per_row_fit():
+    rng = np.random.default_rng(0)
+    X = np.round(np.exp(rng.uniform(0, 2, (20, 1)) + rng.uniform(0.05, 0.4, (20, 1)) * np.arange(30)))
+    X[rng.random(X.shape) < 0.2] = 0
+    rates = growth_rates(X)
+    for row, rate in zip(X, rates):
+        assert math.isclose(rate, _sklearn_slope(row), rel_tol=1e-9, abs_tol=1e-12)
+
+
+def test_growth_rates_window_and_degenerate_rows():
+    X = np.array([[0, 0, 0, 1, 2, 4, 8], [0, 0, 0, 0, 0, 0, 5], [0] * 7])
+    rates = growth_rates(X)
+    assert math.isclose(rates[0], math.log(2))
+    assert np.isnan(rates[1]) and np.isnan(rates[2])
+    assert math.isclose(growth_rates(X[0], window=2), math.log(2))
@@ -0,0 +1,307 @@
+import json
+import sys
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import api
+from api.cache import SQLiteCache
+
+
+def patient(location, age):
+    how = "The value was specified by the end user."
+    return {
+        "piid": "pdspi-guidance-sars-treatment",
+        "settingsRequested": {
+            "modelParameters": [{"id": "pdspi-guidance-sars:loc", "parameterValue": {"value": location}}],
+            "patientVariables": [
+                {"id": "LOINC:30525-0", "variableValue": {"value": age}, "how": how},
+                {"id": "LOINC:45701-0", "variableValue": {"value": True}, "how": how}
+            ]
+        }
+    }
+
+
+def series_patient(location, series):
+    item = patient(location, 40)
+    item["settingsRequested"]["modelParameters"].append({"id": "pdspi-guidance-sars:series",
+                                                         "parameterValue": {"value": series}})
+    return item
+
+
+@pytest.fixture(scope="module")
+def client():
+    with pytest.MonkeyPatch.context() as mp:
+        try:
+            import tx.connexion.utils  # noqa: F401
+        except ImportError:
+            # the PDS helper package is only installed in the image; the reverse proxy fix-up is not needed here
+            utils = types.ModuleType("tx.connexion.utils")
+            utils.ReverseProxied = lambda app: app
+            for name in ["tx", "tx.connexion"]:
+                mp.setitem(sys.modules, name, types.ModuleType(name))
+            mp.setitem(sys.modules, "tx.connexion.utils", utils)
+        from api.server import create_app
+        mp.setattr(api, "vis_spec_mode", "local")
+        yield create_app().app.test_client()
+
+
+def fake_outputs(age=None, weight=None, bmi=None, location=None, memo=None, **kwargs):
+    # the first patients take longest, so that they finish last
+    time.sleep(0.05 / (1 + int(age)))
+    if location == "PA":
+        raise RuntimeError("no data for PA")
+    return [{"id": "oid-1", "description": location}]
+
+
+@pytest.fixture
+def executor(monkeypatch):
+    monkeypatch.setattr(api, "generate_vis_outputs", fake_outputs)
+
+    def use(queue):
+        monkeypatch.setattr(api, "guidance_executor", None if queue is None else ThreadPoolExecutor(4))
+        monkeypatch.setattr(api, "guidance_executor_type", "none" if queue is None else "thread")
+        monkeypatch.setattr(api, "guidance_queue", queue)
+    return use
+
+
+def test_parallel_guidance_is_in_body_order_and_independent_of_the_queue(executor):
+    body = [patient(location, age) for age, location in enumerate(["NC", "NY", "SC", "VA"] * 3)]
+    results = {}
+    for queue in [None, 0, 1, 3, 10]:
+        executor(queue)
+        results[queue] = list(api._iter_guidance(body))
+    for queue in [0, 1, 3, 10]:
+        assert results[queue] == results[None]
+    assert [g["advanced"][0]["description"] for g in results[None]] == ["NC", "NY", "SC", "VA"] * 3
+    assert [len(g["settingsUsed"]["patientVariables"]) for g in results[None]] == list(range(2, 26, 2))
+
+
+def test_parallel_guidance_isolates_failing_patients(executor):
+    executor(2)
+    body = [patient("NC", 0), patient("PA", 1), patient("NY", 2), patient("VA", 3)]
+    del body[2]["settingsRequested"]["patientVariables"][1]["how"]
+    results = list(api._iter_guidance(body))
+    assert [g["advanced"][0]["description"] if g["advanced"] else None for g in results] == ["NC", None, None, "VA"]
+    assert "no data for PA" in results[1]["message"][0]["event"]
+    assert "how" in results[2]["message"][0]["event"]
+    assert results[1]["cards"] == results[2]["cards"] == []
+    # the variables NY read before failing are not reported for the later patients
+    assert [var["variableValue"]["value"] for var in results[3]["settingsUsed"]["patientVariables"]] == \
+        [0, True, 1, True, 3, True]
+
+
+@pytest.mark.parametrize("series", [{"resolution": "bogus"}, "weekly", {"last": "abc"}, {"last": -1},
+                                    {"points": 1, "resolution": "lttb"}, {"start": "March"}])
+def test_invalid_series_model_parameter_is_rejected(client, series):
+    resp = client.post("/guidance", json=[patient("NC", 40), series_patient("NY", series)])
+    assert resp.status_code == 400
+    assert "pdspi-guidance-sars:series" in resp.get_json()["message"][0]["event"]
+
+
+def test_series_model_parameter(client):
+    resp = client.post("/guidance?outputs=oid-1", json=[series_patient("NC", {"points": 10, "resolution": "lttb"})])
+    assert resp.status_code == 200
+    assert len(resp.get_json()[0]["advanced"][0]["data"]) == 20
+
+
+def test_guidance_etag_is_withheld_when_a_spec_is_missing(client, monkeypatch):
+    monkeypatch.setattr(api, "guidance_cacheable", True)
+    body = [patient("NC", 40)]
+    resp = client.post("/guidance", json=body)
+    etag = resp.headers["ETag"]
+    assert client.post("/guidance", json=body, headers={"If-None-Match": etag}).status_code == 304
+
+    api.location_cache.clear()
+    monkeypatch.setattr(api, "vis_spec_mode", "remote")
+    monkeypatch.setattr(api, "generate_vis_spec", lambda *args: {})
+    resp = client.post("/guidance?outputs=oid-1,oid-2", json=body)
+    assert resp.status_code == 200 and resp.get_json()[0]["advanced"][0]["specs"] == [{}]
+    assert "ETag" not in resp.headers and resp.headers["Cache-Control"] == "no-store"
+    api.location_cache.clear()
+
+
+def outputs_patient(location, outputs):
+    item = patient(location, 40)
+    item["settingsRequested"]["modelParameters"].append({"id": "pdspi-guidance-sars:outputs",
+                                                         "parameterValue": {"value": outputs}})
+    return item
+
+
+@pytest.fixture
+def only_oid_1(monkeypatch):
+    # the data of every output but oid-1 fails if it is computed
+    import api.utils
+
+    def fail(*args, **kwargs):
+        raise AssertionError("computed an output that was not requested")
+
+    api.location_cache.clear()
+    for name in ["get_multi_time_series_data", "generate_scatter_plot_data", "generate_histogram_data"]:
+        monkeypatch.setattr(api.utils, name, fail)
+    yield
+    api.location_cache.clear()
+
+
+def test_outputs_query_parameter(client, only_oid_1):
+    resp = client.post("/guidance?outputs=oid-1", json=[patient("NC", 40)])
+    assert resp.status_code == 200
+    assert [output["id"] for output in resp.get_json()[0]["advanced"]] == ["oid-1"]
+
+
+def test_outputs_model_parameter(client, only_oid_1):
+    resp = client.post("/guidance", json=[outputs_patient("NC", ["oid-1"]), outputs_patient("NY", "oid-1")])
+    assert resp.status_code == 200
+    assert [[output["id"] for output in g["advanced"]] for g in resp.get_json()] == [["oid-1"], ["oid-1"]]
+
+
+def test_unknown_outputs_are_rejected(client):
+    resp = client.post("/guidance?outputs=oid-1,oid-42", json=[patient("NC", 40)])
+    assert resp.status_code == 400 and "oid-42" in resp.get_json()["message"][0]["event"]
+    resp = client.post("/guidance", json=[outputs_patient("NC", "oid-6")])
+    assert resp.status_code == 400 and "oid-6" in resp.get_json()["message"][0]["event"]
+
+
+def test_result_cache_key_separates_output_selections(tmp_path, monkeypatch):
+    monkeypatch.setattr(api, "result_cache", SQLiteCache(str(tmp_path / "cache.sqlite")))
+    monkeypatch.setattr(api, "vis_spec_mode", "local")
+    first = api.generate_vis_outputs(location="NC", output_ids=frozenset(["oid-1"]))
+    second = api.generate_vis_outputs(location="NC", output_ids=frozenset(["oid-3", "oid-4"]))
+    assert [output["id"] for output in first] == ["oid-1"]
+    assert [output["id"] for output in second] == ["oid-3", "oid-4"]
+    assert len(api.result_cache) == 2
+    assert api.generate_vis_outputs(location="NC", output_ids=frozenset(["oid-1"])) == first
+    assert api.result_cache.stats()["hits"] == 1
+
+
+def bmi_patient(location, bmi):
+    item = patient(location, 40)
+    item["settingsRequested"]["patientVariables"].append({"id": "LOINC:39156-5", "variableValue": {"value": bmi},
+                                                          "how": "The value was specified by the end user."})
+    return item
+
+
+def test_location_outputs_are_computed_once_per_request(client, monkeypatch):
+    import api.utils
+    calls = []
+    histogram = api.utils.generate_histogram_data
+    monkeypatch.setattr(api.utils, "generate_histogram_data", lambda n: calls.append(n) or histogram(n))
+    # no per-worker cache, only the request-scoped memo
+    monkeypatch.setattr(api, "location_cache", api.LRUCache(maxsize=0))
+    resp = client.post("/guidance", json=[bmi_patient("NC", 20), bmi_patient("NC", 30), bmi_patient("NC", 40)])
+    assert resp.status_code == 200
+    # oid-4 once for NC, oid-5 (BMI) once per patient
+    assert len(calls) == 4
+    first, second, third = ({output["id"]: output for output in g["advanced"]} for g in resp.get_json())
+    assert first["oid-4"] == second["oid-4"] == third["oid-4"]
+    resp = client.post("/guidance", json=[bmi_patient("NC", 20), bmi_patient("NY", 30)])
+    assert len(calls) == 4 + 4
+
+
+def test_cohort_mode_isolates_patient_settings(client, monkeypatch):
+    body = [patient("NC", 40), bmi_patient("NY", 30), patient("VA", 50)]
+    resp = client.post("/guidance?outputs=oid-1", json=body)
+    assert [len(g["settingsUsed"]["patientVariables"]) for g in resp.get_json()] == [2, 5, 7]
+    monkeypatch.setattr(api, "cohort_mode", True)
+    resp = client.post("/guidance?outputs=oid-1", json=body)
+    settings = [g["settingsUsed"]["patientVariables"] for g in resp.get_json()]
+    assert [[var["variableValue"]["value"] for var in variables] for variables in settings] == \
+        [[40, True], [40, True, 30], [50, True]]
+
+
+def test_cohort_response_size_limit(client, monkeypatch):
+    monkeypatch.setattr(api, "cohort_mode", True)
+    body = [patient(location, 40) for location in ["NC", "NY", "VA"]]
+    size = len(client.post("/guidance?outputs=oid-1", json=body[:2]).data)
+    monkeypatch.setattr(api, "cohort_max_bytes", size + 10)
+    assert client.post("/guidance?outputs=oid-1", json=body[:2]).status_code == 200
+    resp = client.post("/guidance?outputs=oid-1", json=body)
+    assert resp.status_code == 400
+    assert "3 patients exceeds the response limit" in resp.get_json()["message"][0]["event"]
+
+    resp = client.post("/guidance?outputs=oid-1", json=body, headers={"Accept": "application/x-ndjson"})
+    lines = [json.loads(line) for line in resp.data.decode().splitlines()]
+    # the stream has started, the error replaces the patient that crosses the limit
+    assert len(lines) == 3 and "advanced" in lines[1]
+    assert "3 patients exceeds the response limit" in lines[2]["message"][0]["event"]
+
+
+@pytest.mark.parametrize("accept, mimetype", [
+    (None, "application/json"),
+    ("application/json", "application/json"),
+    ("application/x-ndjson", "application/x-ndjson"),
+    ("application/x-ndjson;q=0.5, application/json", "application/json"),
+    ("application/json;q=0.5, application/x-ndjson", "application/x-ndjson"),
+    ("*/*", "application/json")
+])
+def test_guidance_format_negotiation(client, accept, mimetype):
+    body = [patient("NC", 40), patient("NY", 50)]
+    resp = client.post("/guidance?outputs=oid-1", json=body, headers={"Accept": accept} if accept else {})
+    assert resp.status_code == 200 and resp.mimetype == mimetype
+    if mimetype == "application/json":
+        guidance = resp.get_json()
+    else:
+        guidance = [json.loads(line) for line in resp.data.decode().splitlines()]
+    assert [g["advanced"][0]["description"][-2:] for g in guidance] == ["NC", "NY"]
+
+
+def test_ndjson_compact_format(client):
+    resp = client.post("/guidance?outputs=oid-1", json=[patient("NC", 40)],
+                       headers={"Accept": "application/x-ndjson; format=compact"})
+    assert resp.mimetype == "application/x-ndjson"
+    assert json.loads(resp.data)["advanced"][0]["data"]["format"] == "columnar"
+
+
+def test_ready_reports_result_cache_stats(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(api, "result_cache", SQLiteCache(str(tmp_path / "cache.sqlite")))
+    for _ in range(3):
+        client.post("/guidance?outputs=oid-1", json=[patient("NC", 40)])
+    resp = client.get("/ready")
+    assert resp.status_code == 200
+    assert resp.get_json()["resultCache"] == {"hits": 2, "misses": 1, "size": 1}
+
+
+def test_guidance_etag_is_withheld_when_the_data_changes_during_the_request(client, monkeypatch):
+    monkeypatch.setattr(api, "guidance_cacheable", True)
+    version = {"served": "1"}
+    monkeypatch.setattr(api, "data_version", lambda: version["served"])
+    assert client.post("/guidance?outputs=oid-1", json=[patient("NC", 40)]).headers["ETag"]
+    iter_guidance = api._iter_guidance
+
+    def reload_during_request(*args):
+        yield from iter_guidance(*args)
+        version["served"] = "2"
+
+    monkeypatch.setattr(api, "_iter_guidance", reload_during_request)
+    resp = client.post("/guidance?outputs=oid-1", json=[patient("NY", 40)])
+    assert "ETag" not in resp.headers and resp.headers["Cache-Control"] == "no-store"
+
+
+class CountingSession:
+    # stands in for the tx-vis session and counts its POSTs
+    def __init__(self):
+        self.posts = 0
+
+    def post(self, url, json=None, **kwargs):
+        self.posts += 1
+        return types.SimpleNamespace(status_code=200, json=lambda: {"typeid": json["typeid"]})
+
+
+def test_guidance_after_prewarm_makes_no_vis_requests(client, monkeypatch):
+    session = CountingSession()
+    monkeypatch.setattr(api, "vis_session", session)
+    monkeypatch.setattr(api, "vis_spec_mode", "remote")
+    monkeypatch.setattr(api, "vis_spec_cache", api.LRUCache())
+    assert api.prewarm_vis_specs() == len(api.vis_spec_cache) > 0
+    prewarm_posts = session.posts
+    assert prewarm_posts > 0
+
+    api.location_cache.clear()
+    for location in ["NC", "NY"]:
+        resp = client.post("/guidance", json=[patient(location, 40)])
+        assert resp.status_code == 200
+        assert all(output["specs"][0] for output in resp.get_json()[0]["advanced"])
+    assert session.posts == prewarm_posts
+    api.location_cache.clear()
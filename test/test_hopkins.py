@@ -0,0 +1,90 @@
+import math
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.linear_model import LinearRegression
+
+from api import hopkins
+from api.utils import get_model_inputs
+
+census_file = os.path.join(os.path.dirname(__file__), "..", "data", "census.csv")
+dates = ["3/{}/20".format(day) for day in range(1, 9)]
+rows = [
+    ("North Carolina", "US", 35.6, -79.8, [0, 0, 1, 2, 5, 9, 17, 33]),
+    ("Hubei", "China", 30.9, 112.2, [444, 549, 761, 1058, 1423, 3554, 3554, 4903]),
+    ("New York", "US", 42.1, -74.9, [0, 1, 0, 3, 8, 25, 76, 216]),
+]
+
+
+def _read_data(url):
+    # the columns of an archived Hopkins CSV as strings, with the trailing column that _convert_data drops
+    scale = {"confirmed": 10, "deaths": 1, "recovered": 2}[next(k for k, v in hopkins.hopkins_urls.items() if v == url)]
+    data = {"Province/State": [], "Country/Region": [], "Lat": [], "Long": []}
+    for state, country, lat, long, counts in rows:
+        data["Province/State"].append(state)
+        data["Country/Region"].append(country)
+        data["Lat"].append(str(lat))
+        data["Long"].append(str(long))
+        for date, count in zip(dates, counts):
+            data.setdefault(date, []).append(str(count * scale))
+        data.setdefault("", []).append("")
+    return data
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    os.makedirs(str(tmp_path / "data"))
+    shutil.copy(census_file, str(tmp_path / "data" / "census.csv"))
+    monkeypatch.chdir(str(tmp_path))
+    monkeypatch.setattr(hopkins, "_read_data", _read_data)
+    monkeypatch.setattr(hopkins, "offline", False)
+    return tmp_path
+
+
+def _old_doubling_time(conf, name):
+    # the per-state fit that get_model_inputs replaced
+    data = conf[conf["Province/State"] == name].drop("Province/State", axis=1).iloc[0]
+    data = data.loc[data != 0]
+    lm = LinearRegression()
+    lm.fit(np.arange(data.shape[0]).reshape(-1, 1), data.apply(math.log))
+    return 1 / np.log2(1 + lm.coef_[0])
+
+
+def test_snapshot_round_trips_the_columns(data_dir):
+    file_name = hopkins.download_snapshot(hopkins.hopkins_file)
+    store = hopkins._load(file_name)
+    for series, url in hopkins.hopkins_urls.items():
+        expected = hopkins._convert_data(_read_data(url))
+        assert list(store[series]) == list(expected)
+        for column, values in expected.items():
+            assert store[series][column].tolist() == values
+    census = pd.read_csv(census_file)
+    assert store["census"]["NAME"].tolist() == census["NAME"].tolist()
+    assert store["census"]["POPESTIMATE2019"].tolist() == census["POPESTIMATE2019"].tolist()
+
+
+def test_model_inputs_match_the_per_state_fit(data_dir):
+    inputs = get_model_inputs()
+    assert sorted(inputs) == ["New York", "North Carolina"]
+    conf = pd.DataFrame.from_dict(hopkins._convert_data(_read_data(hopkins.hopkins_urls["confirmed"])))
+    conf = conf.drop(["Lat", "Long", "Country/Region"], axis=1)
+    for name, (N, I, R, D, td) in inputs.items():
+        counts = next(counts for state, _, _, _, counts in rows if state == name)
+        # as before, the totals add up every day of the series
+        assert (I, D, R) == (10 * sum(counts), sum(counts), 2 * sum(counts))
+        assert math.isclose(td, _old_doubling_time(conf, name), rel_tol=1e-9)
+    assert inputs["North Carolina"][0] == 10488084
+
+
+def test_offline_does_not_download_a_missing_snapshot(data_dir, monkeypatch):
+    def download(url):
+        raise AssertionError("downloaded {}".format(url))
+
+    monkeypatch.setattr(hopkins, "_read_data", download)
+    monkeypatch.setattr(hopkins, "offline", True)
+    with pytest.raises(RuntimeError, match="DATA_OFFLINE"):
+        hopkins.get_store(hopkins.hopkins_file)
+    assert not os.path.exists(hopkins.hopkins_file)
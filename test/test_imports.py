@@ -0,0 +1,10 @@
+import subprocess
+import sys
+from os import path
+
+
+def test_import_api_does_not_load_numerical_packages():
+    code = "import sys, api; print(' '.join(m for m in ('pandas', 'sklearn', 'comodels', 'numpy') if m in sys.modules))"
+    out = subprocess.run([sys.executable, '-c', code], cwd=path.dirname(path.dirname(path.abspath(__file__))),
+                         capture_output=True, text=True, check=True).stdout
+    assert out.split() == []
@@ -0,0 +1,45 @@
+import glob
+import json
+
+from api.nytimes import get_state_series, nytimes_file, refresh_snapshot, state_points
+
+
+def test_store_rows_equal_the_snapshot_points():
+    with open(nytimes_file) as f:
+        state_data = json.load(f)
+    for name, points in state_data.items():
+        assert state_points(*get_state_series(name)) == points
+
+
+csv_rows = [
+    ("2020-03-01", "North Carolina", 1, 0),
+    ("2020-03-01", "New York", 5, 0),
+    ("2020-03-02", "North Carolina", 3, 0),
+    ("2020-03-02", "New York", 9, 1),
+    ("2020-03-03", "New York", 20, 2),
+    ("2020-03-04", "North Carolina", 7, 1),
+    ("2020-03-04", "New York", 40, 3)
+]
+
+
+def write_csv(file_name, rows):
+    with open(file_name, "w") as f:
+        f.write("date,state,fips,cases,deaths\n")
+        f.writelines("{},{},0,{},{}\n".format(*row) for row in rows)
+
+
+def test_incremental_refresh_equals_a_full_rebuild(tmp_path):
+    csv_file, full, incremental = (str(tmp_path / name) for name in ["us-states.csv", "full.json", "inc.json"])
+    write_csv(csv_file, csv_rows[:4])
+    assert refresh_snapshot(incremental, csv_file, incremental=True) == "2020-03-02"
+    assert refresh_snapshot(incremental, csv_file, incremental=True) is None
+    write_csv(csv_file, csv_rows)
+    assert refresh_snapshot(incremental, csv_file, incremental=True) == "2020-03-04"
+    assert refresh_snapshot(full, csv_file) == "2020-03-04"
+    with open(full) as f, open(incremental) as g:
+        full_data, incremental_data = json.load(f), json.load(g)
+    assert incremental_data == full_data
+    # North Carolina did not report on 2020-03-03
+    assert [p["y"] for p in full_data["North Carolina"]] == [1, 3, 0, 7, 0, 0, 0, 1]
+    assert sorted(glob.glob(str(tmp_path / "inc.*.json"))) == [str(tmp_path / "inc.2020-03-02.json"),
+                                                               str(tmp_path / "inc.2020-03-04.json")]
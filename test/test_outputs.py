@@ -0,0 +1,118 @@
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pytest
+
+import api
+from api import snapshot
+from api.cache import SQLiteCache
+from api.nytimes import get_store, state_points
+
+
+@pytest.fixture(autouse=True)
+def local_specs(monkeypatch):
+    monkeypatch.setattr(api, "vis_spec_mode", "local")
+    api.location_cache.clear()
+    yield
+    api.location_cache.clear()
+
+
+@pytest.mark.parametrize("selector, ids", [
+    ("treatment", ["oid-1", "oid-2", "oid-3", "oid-4", "oid-5"]),
+    ("resource", ["oid-1", "oid-2", "oid-6", "oid-7", "oid-8", "oid-9"])
+])
+def test_outputs_of_each_selector(monkeypatch, selector, ids):
+    monkeypatch.setattr(api, "selector_val", selector)
+    outputs = api.generate_vis_outputs(bmi=25, location="NC")
+    assert [output["id"] for output in outputs] == ids
+    for output in outputs:
+        assert output["data"] and output["specs"][0]
+
+
+def _vis_executor_runs():
+    return api.vis_executor.submit(lambda: "ran").result(timeout=5)
+
+
+def test_vis_executor_runs_in_forked_processes():
+    # start the parent's vis-spec threads, which a forked child does not inherit
+    assert _vis_executor_runs() == "ran"
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("fork")) as pool:
+        assert pool.submit(_vis_executor_runs).result(timeout=10) == "ran"
+
+
+def test_warmup_is_not_ready_if_every_location_failed(monkeypatch):
+    def outputs(location=None, **kwargs):
+        if location != "NC":
+            raise RuntimeError("no data")
+        return []
+
+    monkeypatch.setattr(api, "generate_vis_outputs", outputs)
+    monkeypatch.setattr(api, "warmup_state", {"ready": False, "timings": {}, "failed": []})
+    state = api.warmup()
+    assert state["ready"] and state["failed"] == ["default", "NY", "PA", "SC", "VA"]
+    monkeypatch.setattr(api, "config", {"settingsDefaults": {"modelParameters": []}})
+    state = api.warmup()
+    assert not state["ready"] and state["failed"] == ["default"]
+    assert api.get_ready()[1] == 503
+
+
+def test_warmup_starts_once_per_process(monkeypatch):
+    calls = []
+    monkeypatch.setattr(api, "warmup", lambda: calls.append(os.getpid()))
+    monkeypatch.setattr(api, "_warmup_pid", None)
+    for _ in range(3):
+        api.start_warmup()
+    time.sleep(0.2)
+    assert calls == [os.getpid()]
+
+
+def test_cached_specs_skip_the_vis_executor(monkeypatch):
+    monkeypatch.setattr(api, "vis_spec_mode", "remote")
+    monkeypatch.setattr(api, "vis_spec_cache", api.LRUCache())
+    spec_args = [out["spec"] for out in api.vis_output_table(bmi=True, location="NC")]
+    assert {len(args) for args in spec_args} == {5, 6}
+    for n, args in enumerate(spec_args):
+        api.vis_spec_cache.put(api._vis_spec_key(args), {"n": n})
+    pending, _ = api.submit_vis_specs(spec_args)
+    assert pending == [{"n": n} for n in range(len(spec_args))]
+
+
+@pytest.mark.parametrize("result_cache", [False, True])
+def test_caches_do_not_keep_a_stale_snapshot(tmp_path, monkeypatch, result_cache):
+    import api.utils
+    file_name = str(tmp_path / "nytimes.json")
+    monkeypatch.setattr(api.utils, "nytimes_file", file_name)
+    monkeypatch.setattr(api, "data_version", lambda: snapshot.data_version(str(tmp_path)))
+    monkeypatch.setattr(api, "result_cache", SQLiteCache(str(tmp_path / "cache.sqlite")) if result_cache else None)
+    release = threading.Event()
+    reload = snapshot._reload
+    monkeypatch.setattr(snapshot, "_reload", lambda *args: release.wait(5) and reload(*args))
+
+    def publish_cases(version, cases):
+        points = state_points(np.array(["2020-03-01"]), np.array([cases]), np.array([0]))
+        snapshot.publish(file_name, version, lambda fp: json.dump({"North Carolina": points}, fp))
+
+    def cases():
+        outputs = api.generate_vis_outputs(location="NC", output_ids=frozenset(["oid-1"]))
+        return outputs[0]["data"][0]["y"]
+
+    publish_cases("1", 10)
+    assert cases() == 10
+    publish_cases("2", 20)
+    # the old snapshot is served until the reload is done, and cached under its own version
+    assert cases() == 10
+    release.set()
+    deadline = time.monotonic() + 5
+    while get_store(file_name)["cases"][0, 0] != 20 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert cases() == 20
+    assert cases() == 20
+    if result_cache:
+        assert api.result_cache.stats()["hits"] == 2
+    else:
+        assert len(api.location_cache) == 2
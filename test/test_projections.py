@@ -0,0 +1,26 @@
+import numpy as np
+
+from api.projections import build_projections, get_projection, save_projections
+from api.sir import penn_death_batch
+
+
+inputs = {
+    'North Carolina': (10488084, 5000, 100, 50, 3.1),
+    'New York': (19453561, 80000, 1000, 900, 2.2),
+    # too few cases to estimate a doubling time
+    'Alaska': (731545, 1, 0, 0, np.nan)
+}
+
+
+def test_projections_keep_curve_lengths_and_skip_states_without_doubling_time(tmp_path):
+    file_name = str(tmp_path / "projections.npz")
+    arrays = build_projections(inputs, sds=[0, 0.5], n_days=30)
+    assert arrays['states'].tolist() == ['North Carolina', 'New York']
+    save_projections(arrays, "20200401", file_name)
+    sir = get_projection('New York', 'SIR', 0.5, file_name)
+    assert all(len(values) == 31 and np.isfinite(values).all() for values in sir.values())
+    _, occupancy = penn_death_batch(*inputs['New York'], 0.5, n_days=30)
+    census = get_projection('New York', 'Hospital Census', 0.5, file_name)
+    for group, values in occupancy.items():
+        np.testing.assert_allclose(census[group], values)
+    assert get_projection('Alaska', 'SIR', 0, file_name) is None
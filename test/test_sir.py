@@ -0,0 +1,34 @@
+import numpy as np
+from comodels import PennDeath
+
+from api.sir import penn_death_batch
+
+
+populations = [
+    (10488084, 5000, 100, 50, 3.1),
+    (19453561, 80000, 1000, 900, 2.2),
+    (731545, 3, 0, 0, 6.5),
+]
+contact_reductions = [0, 0.25, 0.5, 0.9]
+
+
+def test_penn_death_batch_matches_penn_death():
+    N, I, R, D, td = (np.array(col, dtype=float)[:, None] for col in zip(*populations))
+    curve, occupancy = penn_death_batch(N, I, R, D, td, np.array(contact_reductions)[None, :], n_days=60)
+    for i, (n, infected, recovered, dead, t_double) in enumerate(populations):
+        for j, sds in enumerate(contact_reductions):
+            model = PennDeath(n, infected, recovered, dead, 0, contact_reduction=sds, t_double=t_double,
+                              recover_time=23)
+            ref_curve, ref_occupancy = model.sir(60)
+            assert ref_curve.keys() == curve.keys()
+            assert ref_occupancy.keys() == occupancy.keys()
+            for k, values in ref_curve.items():
+                np.testing.assert_allclose(curve[k][i, j], values, rtol=1e-9)
+            for k, values in ref_occupancy.items():
+                np.testing.assert_allclose(occupancy[k][i, j], values, rtol=1e-9, atol=1e-6)
+
+
+def test_penn_death_batch_broadcasts_scalars():
+    curve, occupancy = penn_death_batch(10488084, 5000, 100, 50, 3.1, n_days=30)
+    assert curve['infected'].shape == (31,)
+    assert occupancy['hospital'].shape == (30 - 7 + 1,)
@@ -0,0 +1,72 @@
+import os
+import threading
+import time
+
+from api import snapshot
+from api.snapshot import data_version, get_snapshot, publish
+
+
+def test_data_version_changes_when_data_is_replaced(tmp_path):
+    file_name = str(tmp_path / "series.json")
+    publish(file_name, "20200401", lambda fp: fp.write("{}"))
+    version = data_version(str(tmp_path))
+    assert data_version(str(tmp_path)) == version
+    publish(file_name, "20200402", lambda fp: fp.write('{"a": 1}'))
+    assert data_version(str(tmp_path)) != version
+    assert os.path.exists(file_name)
+
+
+def test_publish_swaps_and_prunes_versions(tmp_path):
+    file_name = str(tmp_path / "series.json")
+    publish(file_name, "1", lambda fp: fp.write("one"))
+    with open(file_name) as reader:
+        for version in ["2", "3"]:
+            publish(file_name, version, lambda fp: fp.write(version * 3), keep=2)
+        # a reader of the previous snapshot keeps reading it in full
+        assert reader.read() == "one"
+    with open(file_name) as f:
+        assert f.read() == "333"
+    assert sorted(os.listdir(str(tmp_path))) == ["series.2.json", "series.3.json", "series.json"]
+
+
+def test_stale_snapshot_is_served_until_the_reload_is_done(tmp_path):
+    file_name = str(tmp_path / "series.json")
+    release = threading.Event()
+
+    def load(name):
+        with open(name) as f:
+            content = f.read()
+        if content == "new":
+            release.wait(5)
+        return content
+
+    publish(file_name, "1", lambda fp: fp.write("old"))
+    assert get_snapshot(file_name, load) == "old"
+    publish(file_name, "2", lambda fp: fp.write("new"))
+    # the first call after the swap starts the reload in the background and returns at once
+    assert [get_snapshot(file_name, load) for _ in range(3)] == ["old"] * 3
+    release.set()
+    deadline = time.monotonic() + 5
+    while get_snapshot(file_name, load) != "new" and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert get_snapshot(file_name, load) == "new"
+
+
+def test_data_version_is_the_served_version_until_the_reload_is_done(tmp_path, monkeypatch):
+    file_name = str(tmp_path / "series.json")
+    release = threading.Event()
+    reload = snapshot._reload
+    monkeypatch.setattr(snapshot, "_reload", lambda *args: release.wait(5) and reload(*args))
+
+    publish(file_name, "1", lambda fp: fp.write("old"))
+    get_snapshot(file_name, lambda name: open(name).read())
+    version = data_version(str(tmp_path))
+    publish(file_name, "2", lambda fp: fp.write("new"))
+    assert get_snapshot(file_name, lambda name: open(name).read()) == "old"
+    # neither the replaced file nor the new versioned copy change the version while the old snapshot is served
+    assert data_version(str(tmp_path)) == version
+    release.set()
+    deadline = time.monotonic() + 5
+    while get_snapshot(file_name, lambda name: open(name).read()) != "new" and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert data_version(str(tmp_path)) != version
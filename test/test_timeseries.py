@@ -0,0 +1,37 @@
+import numpy as np
+
+from api.timeseries import lttb, resample, weekly, window
+
+
+dates = np.arange('2020-03-01', '2020-04-01', dtype='datetime64[D]').astype(str)
+values = np.arange(len(dates))
+
+
+def test_window():
+    d, (v,) = window(dates, [values], start='2020-03-05', end='2020-03-10')
+    assert d.tolist() == ['2020-03-0{}'.format(i) for i in range(5, 10)] + ['2020-03-10']
+    assert v.tolist() == list(range(4, 10))
+    d, (v,) = window(dates, [values], end='2020-03-10', last=3)
+    assert d.tolist() == ['2020-03-08', '2020-03-09', '2020-03-10']
+
+
+def test_weekly_keeps_the_last_day_of_each_week():
+    d, (v,) = weekly(dates, [values])
+    # 2020-03-01 and 2020-03-08 were Sundays
+    assert d.tolist() == ['2020-03-01', '2020-03-08', '2020-03-15', '2020-03-22', '2020-03-29', '2020-03-31']
+    assert v.tolist() == [0, 7, 14, 21, 28, 30]
+
+
+def test_lttb_keeps_ends_and_peaks():
+    y = np.zeros(100)
+    y[37] = 10
+    kept = lttb(y, 10)
+    assert len(kept) == 10 and kept[0] == 0 and kept[-1] == 99 and 37 in kept
+    assert np.all(np.diff(kept) > 0)
+    assert lttb(y[:5], 10).tolist() == [0, 1, 2, 3, 4]
+
+
+def test_resample_lttb_per_column():
+    (d1, v1), (d2, v2) = resample(dates, [values, values[::-1]], resolution='lttb', points=5)
+    assert len(d1) == len(v1) == len(d2) == 5
+    assert d1[0] == '2020-03-01' and d1[-1] == '2020-03-31'